@@ -2,7 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Tier, User, UploadedImage, AvailableHeight
+from .models import Tier, User, UploadedImage, AvailableHeight, RenditionJob, BackfillJob
 from django.urls import reverse
 from django.utils.html import format_html
 
@@ -47,12 +47,33 @@ class AvailableHeightAdmin(admin.ModelAdmin):
 
 class TierAdmin(admin.ModelAdmin):
     model = Tier
-    list_display = ["name", "original_image", "binary_image", "extra_image_sizes"]
-    list_filter = ["original_image", "binary_image"]
+    list_display = ["name", "original_image", "binary_image", "extra_image_sizes", "lazy_thumbnails", "signed_url_timeout", "variant_formats", "encoder_profile"]
+    list_filter = ["original_image", "binary_image", "lazy_thumbnails"]
+
+
+
+class RenditionJobAdmin(admin.ModelAdmin):
+    model = RenditionJob
+    list_display = ["thumbnail", "owner", "priority", "fair_rank", "attempts", "created_at"]
+    readonly_fields = ["thumbnail", "owner", "priority", "fair_rank", "attempts", "last_error"]
+
+
+
+class BackfillJobAdmin(admin.ModelAdmin):
+    model = BackfillJob
+    list_display = ["__str__", "heights", "progress", "attempts", "created_at", "finished_at"]
+    list_filter = [("finished_at", admin.EmptyFieldListFilter)]
+    readonly_fields = ["user", "tier", "heights", "cursor", "processed", "total", "progress", "finished_at", "attempts", "last_error"]
+
+    @admin.display(description="Progress")
+    def progress(self, obj) -> str:
+        return f"{obj.progress} ({obj.processed}/{obj.total})"
 
 
 
 admin.site.register(Tier, TierAdmin)
 admin.site.register(User, UserAdmin)
 admin.site.register(UploadedImage, UploadedImageAdmin)
-admin.site.register(AvailableHeight, AvailableHeightAdmin)
\ No newline at end of file
+admin.site.register(AvailableHeight, AvailableHeightAdmin)
+admin.site.register(RenditionJob, RenditionJobAdmin)
+admin.site.register(BackfillJob, BackfillJobAdmin)
\ No newline at end of file
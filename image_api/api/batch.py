@@ -0,0 +1,165 @@
+import zipfile
+from pathlib import PurePath
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+
+from .cache import invalidate
+from .models import AvailableHeight, UploadedImage, User
+from .reaper import release_later
+from .uploads import ImageRejected, stream_image
+from .utils import get_executor, get_resized_images
+
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BatchItem:
+    """
+    One file of a batch upload, either a file to save or a reason it was rejected
+    """
+    def __init__(self, name: str, file=None, error: str = None):
+        self.name = name
+        self.file = file
+        self.error = error
+
+
+def read_uploaded_files(request, field: str) -> list[BatchItem]:
+    """
+    Returns uploaded files, including files rejected by ImageUploadHandler
+    """
+    items = [BatchItem(file.name, file=file) for file in request.FILES.getlist(field)]
+    upload_errors = getattr(request, "upload_errors", {})
+    items += [BatchItem(name, error=error) for name, error in upload_errors.get(field, [])]
+    if len(items) > settings.BATCH_MAX_FILES:
+        raise serializers.ValidationError({field: [f"Too many files! Maximum is {settings.BATCH_MAX_FILES}."]})
+    return items
+
+
+def read_limited(file, limit: int, error: str):
+    """
+    Returns generator of chunks of the file, raises ImageRejected with given error after more than limit bytes
+    (sizes declared in archives can't be trusted)
+    """
+    size = 0
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > limit:
+            raise ImageRejected(error)
+        yield chunk
+
+
+def read_archive(archive):
+    """
+    Returns generator of images extracted from zip archive, one by one,
+    every image is checked by its header before it's extracted
+
+    Entries bigger than BATCH_MAX_FILE_SIZE, or over BATCH_MAX_ARCHIVE_SIZE all together (uncompressed), are rejected
+    """
+    try:
+        zip_file = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise serializers.ValidationError({"archive": ["Wrong archive! Must be a zip file."]})
+
+    entries = [entry for entry in zip_file.infolist() if not entry.is_dir()]
+    if len(entries) > settings.BATCH_MAX_FILES:
+        raise serializers.ValidationError({"archive": [f"Too many files! Maximum is {settings.BATCH_MAX_FILES}."]})
+
+    def extract():
+        remaining = settings.BATCH_MAX_ARCHIVE_SIZE
+        with zip_file:
+            for entry in entries:
+                name = PurePath(entry.filename).name
+                limit = min(settings.BATCH_MAX_FILE_SIZE, remaining)
+                error = "File is too big!" if limit == settings.BATCH_MAX_FILE_SIZE else "Archive is too big!"
+                if entry.file_size > limit:
+                    yield BatchItem(name, error=error)
+                    continue
+                try:
+                    with zip_file.open(entry) as file:
+                        item = BatchItem(name, file=stream_image(name, read_limited(file, limit, error)))
+                    remaining -= item.file.size
+                    yield item
+                except ImageRejected as e:
+                    yield BatchItem(name, error=str(e))
+                except (zipfile.BadZipFile, RuntimeError, EOFError):
+                    # damaged or encrypted entry
+                    yield BatchItem(name, error="Problem with loading image!")
+
+    return extract()
+
+
+def create_images(owner: User, items) -> list[tuple[BatchItem, UploadedImage | None]]:
+    """
+    Save all given images of the owner, with thumbnails
+
+    Work is pipelined - thumbnails of saved images are already rendered in background threads,
+    while next files are being read, then images are inserted in chunks of BATCH_INSERT_SIZE
+    (so rendered thumbnails of only one chunk are kept in memory).
+    Returns list of (item, created image), image is None for rejected items
+    """
+    heights = None
+    created = []            # (item, image) for every item
+    pending = []            # (image, thumbnails rendered in advance (future)) waiting to be inserted
+    failed = []             # images which couldn't be inserted or decoded
+    for item in items:
+        image = None
+        if item.error is None:
+            try:
+                image = UploadedImage.from_upload(owner, item.file)
+            except Exception:
+                item.error = "Problem with saving image!"
+            finally:
+                item.file.close()       # temporary file is already moved to storage (or not needed)
+        created.append((item, image))
+        if image is None:
+            continue
+
+        if heights is None:
+            heights = image.tier_thumbnail_sizes
+            height_profiles = AvailableHeight.get_profiles(heights)
+        if settings.RENDITION_QUEUE or image.is_duplicate:
+            pending.append((image, None))       # rendered by workers, or already stored for the same file uploaded before
+        else:
+            eager_heights = image.eager_thumbnail_sizes(heights)
+            profiles = image.get_upload_profiles(eager_heights, height_profiles)
+            pending.append((image, get_executor("batch").submit(get_resized_images, image.image, eager_heights, profiles)))
+
+        if len(pending) >= settings.BATCH_INSERT_SIZE:
+            failed += insert_images(owner, heights, pending)
+            pending = []
+    if pending:
+        failed += insert_images(owner, heights, pending)
+
+    for item, image in created:
+        if any(image is f for f in failed):
+            item.error = "Problem with loading image!"
+    return [(item, None if item.error else image) for item, image in created]
+
+
+def insert_images(owner: User, heights: list[int], pending) -> list[UploadedImage]:
+    """
+    Insert given images at once and create their thumbnails (with files rendered in advance),
+    returns images that failed - files of images which couldn't be inserted are released (see from_upload)
+    """
+    images = [image for image, _ in pending]
+    try:
+        with transaction.atomic():
+            UploadedImage.objects.bulk_create(images)
+    except DatabaseError:
+        for image in images:
+            release_later(image.image.name)     # reference taken by from_upload
+        return images
+    invalidate(f"user:{owner.pk}")      # bulk_create doesn't send post_save
+
+    failed = []
+    for image, files in pending:
+        try:
+            image.create_thumbnails(heights, files.result() if files else None)
+        except Exception:
+            # file has correct header, but can't be decoded
+            image.delete()
+            failed.append(image)
+    return failed
@@ -0,0 +1,67 @@
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+
+
+def get_bayer_matrix(size: int) -> np.ndarray:
+    """
+    Bayer index matrix for ordered dithering (size must be a power of 2): https://en.wikipedia.org/wiki/Ordered_dithering
+    """
+    matrix = np.zeros((1, 1), dtype=np.uint16)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
+
+
+BAYER_THRESHOLDS = ((get_bayer_matrix(8) + 0.5) * 256 / 64).astype(np.uint8)     # 8x8 matrix scaled to 0-255
+
+
+def get_otsu_threshold(histogram: list[int]) -> int:
+    """
+    Global threshold maximising variance between classes of pixels: https://en.wikipedia.org/wiki/Otsu%27s_method
+    computed from the histogram of grayscale image only
+    """
+    histogram = np.asarray(histogram, dtype=np.float64)
+    weight = np.cumsum(histogram)                               # pixels <= threshold
+    total = np.cumsum(histogram * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_low = total / weight
+        mean_high = (total[-1] - total) / (weight[-1] - weight)
+        variance = weight * (weight[-1] - weight) * (mean_low - mean_high) ** 2
+    return int(np.argmax(np.nan_to_num(variance)))
+
+
+def binarize_threshold(pixels: np.ndarray) -> np.ndarray:
+    return pixels >= settings.BINARIZATION_THRESHOLD
+
+
+def binarize_otsu(pixels: np.ndarray) -> np.ndarray:
+    histogram = Image.fromarray(pixels).histogram()     # several times faster than np.bincount
+    return pixels > get_otsu_threshold(histogram)
+
+
+def binarize_ordered(pixels: np.ndarray) -> np.ndarray:
+    height, width = pixels.shape
+    size = BAYER_THRESHOLDS.shape[0]
+    thresholds = np.tile(BAYER_THRESHOLDS, (-(-height // size), -(-width // size)))[:height, :width]
+    return pixels > thresholds
+
+
+BINARIZATION_MODES = {      # vectorized over grayscale pixel buffer, error diffusion is done by Pillow
+    "threshold": binarize_threshold,        # fixed threshold (BINARIZATION_THRESHOLD)
+    "otsu": binarize_otsu,                  # Otsu's global threshold
+    "ordered": binarize_ordered,            # ordered dithering with 8x8 Bayer matrix
+    "dither": None,                         # Floyd-Steinberg error diffusion (Pillow's convert("1"))
+}
+
+
+def binarize(img: Image.Image, mode: str = None) -> Image.Image:
+    """
+    Returns 1-bit version of the image, made with given mode (BINARIZATION_MODE by default, see BINARIZATION_MODES)
+    """
+    mode = mode or settings.BINARIZATION_MODE
+    if BINARIZATION_MODES[mode] is None:
+        return img.convert("1")
+    pixels = np.asarray(img.convert("L"))
+    return Image.fromarray(BINARIZATION_MODES[mode](pixels))
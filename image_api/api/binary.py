@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .binarization import binarize
+from .utils import delete_file, replace_file
+
+
+
+BINARY_DIR = "binary"       # binary images are cached in this directory of the storage
+BINARY_FORMATS = {          # formats of binary images, with options of their encoders
+    "PNG": {"optimize": True, "compress_level": 9},     # 1-bit PNG
+    "TIFF": {"compression": "group4"},                  # CCITT Group 4 fax encoding
+}
+
+
+def get_binary_name(image_path: str, img_format: str, params: dict) -> str:
+    """
+    Name of the cached binary image - by source file (files never change under the same name) and conversion parameters
+    """
+    key = hashlib.sha256(json.dumps([image_path, img_format, params], sort_keys=True).encode()).hexdigest()
+    return f"{BINARY_DIR}/{key[:2]}/{key}.{img_format.lower()}"
+
+
+def render_binary_image(path: str, img_format: str, mode: str = None) -> bytes:
+    """
+    Returns image from given path converted to binary image: https://en.wikipedia.org/wiki/Binary_image
+    with given binarization mode (see api.binarization), encoded as true 1-bit image in given format (see BINARY_FORMATS)
+    """
+    with Image.open(path) as img:
+        binary = binarize(img, mode)
+    buffer = BytesIO()
+    binary.save(buffer, format=img_format, **BINARY_FORMATS[img_format])
+    return buffer.getvalue()
+
+
+def get_binary_image(image_path: str, img_format: str = None, mode: str = None) -> tuple[str, str]:
+    """
+    Returns name of the binary version of the image (and its format, BINARY_FORMAT by default), 
+    converted only once and cached on disk (least recently used files are evicted, see evict_binary_images)
+
+    Raises FileNotFoundError if the source doesn't exist anymore (e.g. image was deleted), even if its binary version is cached
+    """
+    if not os.path.exists(default_storage.path(image_path)):
+        raise FileNotFoundError(image_path)
+    img_format = img_format or settings.BINARY_FORMAT
+    mode = mode or settings.BINARIZATION_MODE
+    params = {"mode": "1", "binarization": mode, **BINARY_FORMATS[img_format]}
+    if mode == "threshold":
+        params["threshold"] = settings.BINARIZATION_THRESHOLD
+    name = get_binary_name(image_path, img_format, params)
+    path = Path(default_storage.path(name))
+    try:
+        os.utime(path)      # last use, for eviction
+    except FileNotFoundError:
+        replace_file(path, ContentFile(render_binary_image(default_storage.path(image_path), img_format, mode)))
+        evict_binary_images()
+    return name, img_format
+
+
+def precompute_binary_images(image_paths) -> None:
+    """
+    Convert images to binary in advance (BINARY_CACHE_EAGER setting)
+    """
+    for image_path in image_paths:
+        get_binary_image(image_path)
+
+
+def evict_binary_images(force: bool = False) -> int:
+    """
+    Delete least recently used binary images while they take more than BINARY_CACHE_MAX_SIZE bytes,
+    done at most once per BINARY_CACHE_EVICTION_INTERVAL seconds (by any process), unless forced
+
+    Returns number of freed bytes
+    """
+    if not force and not cache.add("binary_cache_eviction", True, settings.BINARY_CACHE_EVICTION_INTERVAL):
+        return 0
+
+    files = []
+    for path in Path(default_storage.path(BINARY_DIR)).glob("*/*"):
+        if path.suffix == ".tmp":
+            continue        # still being written
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    size = sum(file_size for _, file_size, _ in files)
+    freed = 0
+    for _, _, path in sorted(files):
+        if size - freed <= settings.BINARY_CACHE_MAX_SIZE:
+            break
+        freed += delete_file(path)
+    return freed
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+
+class LocalCache:
+    """
+    Small LRU cache in process memory, entries expire after given timeout (seconds)
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout: float) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_SIZE)
+
+
+def get_generations(*scopes: str) -> tuple:
+    """
+    Current generations of scopes, remembered in process memory for LOCAL_CACHE_TIMEOUT seconds
+    (that's how long other processes can use data invalidated in the shared cache)
+    """
+    generations = {scope: local_cache.get(("generation", scope)) for scope in scopes}
+    missing = [scope for scope, generation in generations.items() if generation is None]
+    if missing:
+        stored = cache.get_many([f"generation:{scope}" for scope in missing])
+        for scope in missing:
+            generation = stored.get(f"generation:{scope}")
+            if generation is None:
+                # new (or evicted) generation starts from current time, so old entries can't be reached again
+                cache.add(f"generation:{scope}", time.time_ns(), timeout=None)
+                generation = cache.get(f"generation:{scope}")
+            local_cache.set(("generation", scope), generation, settings.LOCAL_CACHE_TIMEOUT)
+            generations[scope] = generation
+    return tuple(generations[scope] for scope in scopes)
+
+
+def bump_generation(scope: str) -> None:
+    """
+    Make all values cached in the scope unreachable
+    """
+    key = f"generation:{scope}"
+    cache.add(key, time.time_ns(), timeout=None)
+    try:
+        generation = cache.incr(key)
+    except ValueError:      # evicted in the meantime
+        generation = time.time_ns()
+        cache.set(key, generation, timeout=None)
+    local_cache.set(("generation", scope), generation, settings.LOCAL_CACHE_TIMEOUT)
+
+
+def get_or_compute(key: str, scopes: list[str], compute, timeout: int):
+    """
+    Value cached in process memory and in the shared cache (Redis), 
+    computed again after generation of any of the scopes is bumped or timeout (seconds) passes
+    """
+    versioned_key = ":".join([key, *map(str, get_generations(*scopes))])
+    value = local_cache.get(versioned_key)
+    if value is None:
+        value = cache.get(versioned_key)
+        if value is None:
+            value = compute()
+            cache.set(versioned_key, value, timeout)
+        local_cache.set(versioned_key, value, min(settings.LOCAL_CACHE_TIMEOUT, timeout))
+    return value
+
+
+@dataclass(frozen=True)
+class Invalidation:
+    scope: str
+
+    def __call__(self) -> None:
+        bump_generation(self.scope)
+
+
+def invalidate(scope: str) -> None:
+    """
+    Bump generation of the scope now and once again after commit 
+    (so concurrent requests can't cache data from before the commit)
+    """
+    callback = Invalidation(scope)
+    callback()
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and not any(func == callback for _, func in connection.run_on_commit):
+        transaction.on_commit(callback)     # once per transaction
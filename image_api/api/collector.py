@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import reaper
+from .models import AvailableHeight, UploadedImage
+
+
+
+def get_unavailable_thumbnails():
+    """
+    Thumbnails which can't be served to their owners - their heights aren't available in owners' tiers any more
+    (200px thumbnails are always available)
+    """
+    available = AvailableHeight.objects.filter(tier=OuterRef("owner__tier"), height=OuterRef("height"))
+    return UploadedImage.objects.exclude(parent=None).exclude(height=200).exclude(Exists(available))
+
+
+def mark_orphaned_thumbnails() -> None:
+    """
+    Save the moment thumbnails became unavailable, forget it for thumbnails available again (e.g. user returned to previous tier)
+    """
+    now = timezone.now()
+    unavailable = get_unavailable_thumbnails()
+    unavailable.filter(orphaned_at=None).update(orphaned_at=now)
+    UploadedImage.objects.filter(orphaned_at__isnull=False).exclude(pk__in=unavailable.values("pk")).update(orphaned_at=None)
+
+
+def collect_orphaned_thumbnails(grace_period: int, batch_size: int) -> tuple[int, int]:
+    """
+    Delete thumbnails unavailable for longer than grace_period (seconds), in batches of batch_size,
+    files are deleted in parallel after every batch is committed (by api.reaper)
+
+    Returns number of deleted thumbnails and number of freed bytes
+    """
+    mark_orphaned_thumbnails()
+    orphaned = get_unavailable_thumbnails().filter(orphaned_at__lt=timezone.now() - timedelta(seconds=grace_period))
+
+    deleted, freed = 0, reaper.freed_bytes()
+    while True:
+        with transaction.atomic():
+            thumbnails = list(orphaned.select_for_update(skip_locked=True, of=("self",)).values_list("pk", flat=True)[:batch_size])
+            if not thumbnails:
+                break
+            UploadedImage.objects.filter(pk__in=thumbnails).delete()
+        deleted += len(thumbnails)
+
+    return deleted, reaper.freed_bytes() - freed
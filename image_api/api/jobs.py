@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import BackfillJob, RenditionJob
+
+
+
+def process_next_rendition_job() -> bool:
+    """
+    Take the next job from the queue and render its thumbnail together with
+    all other waiting thumbnails of the same original (it's decoded only once for all of them)
+
+    Jobs are locked with SKIP LOCKED, so many workers can share the queue,
+    and deleted in the same transaction in which they are rendered - job of a crashed worker gets back to the queue
+
+    Returns False if there was nothing to do
+    """
+    queue = RenditionJob.objects.select_for_update(skip_locked=True, of=("self",)).filter(attempts__lt=settings.RENDITION_JOB_MAX_ATTEMPTS)
+
+    with transaction.atomic():
+        job = queue.select_related("thumbnail__parent").order_by("priority", "fair_rank", "id").first()
+        if job is None:
+            return False
+
+        original = job.thumbnail.parent
+        jobs = [job] + list(queue.filter(thumbnail__parent=original, priority=job.priority).exclude(pk=job.pk).select_related("thumbnail"))
+        jobs_pk = [j.pk for j in jobs]
+
+        try:
+            with transaction.atomic():
+                original.render_thumbnails([j.thumbnail for j in jobs])
+                RenditionJob.objects.filter(pk__in=jobs_pk).delete()
+        except Exception as e:
+            # keep job in the queue, it will be retried until RENDITION_JOB_MAX_ATTEMPTS is reached
+            RenditionJob.objects.filter(pk__in=jobs_pk).update(attempts=F("attempts") + 1, last_error=repr(e))
+
+    return True
+
+
+
+def process_next_backfill_job() -> bool:
+    """
+    Process the next chunk of the oldest unfinished backfill job,
+    thumbnails are enqueued to rendition queue
+
+    Failed chunk is rolled back and retried until BACKFILL_JOB_MAX_ATTEMPTS is reached, then the job is abandoned
+    (with the error kept in last_error), so one bad chunk can't stop the worker nor other jobs
+
+    Returns False if there was nothing to do
+    """
+    queue = BackfillJob.objects.select_for_update(skip_locked=True).filter(finished_at=None, attempts__lt=settings.BACKFILL_JOB_MAX_ATTEMPTS)
+
+    with transaction.atomic():
+        job = queue.order_by("id").first()
+        if job is None:
+            return False
+
+        try:
+            with transaction.atomic():
+                job.run_chunk()
+        except Exception as e:
+            BackfillJob.objects.filter(pk=job.pk).update(attempts=F("attempts") + 1, last_error=repr(e))
+        else:
+            if job.attempts:
+                BackfillJob.objects.filter(pk=job.pk).update(attempts=0)      # attempts are counted for every chunk
+
+    return True
@@ -0,0 +1,34 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from api.binarization import BINARIZATION_MODES, binarize
+
+
+
+class Command(BaseCommand):
+    help = "Compare speed of binarization modes with Pillow's convert(\"1\") (previous implementation of binary images)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", nargs="*", help="Images to convert, random noise of --size is used if none given")
+        parser.add_argument("--size", type=int, nargs=2, default=(4000, 3000), metavar=("WIDTH", "HEIGHT"), help="Size of generated image")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each mode, the best one is reported")
+
+    def handle(self, *args, **options):
+        if options["images"]:
+            images = {path: Image.open(path) for path in options["images"]}
+        else:
+            images = {"noise %dx%d" % tuple(options["size"]): Image.effect_noise(tuple(options["size"]), 64).convert("RGB")}
+
+        for name, img in images.items():
+            img.load()
+            baseline = self.measure(lambda: img.convert("1"), options["repeat"])
+            self.stdout.write(f"{name}: convert(\"1\") {baseline * 1000:.1f} ms")
+            for mode in BINARIZATION_MODES:
+                elapsed = self.measure(lambda: binarize(img, mode), options["repeat"])
+                self.stdout.write(f"    {mode:<10} {elapsed * 1000:8.1f} ms  {baseline / elapsed:5.2f}x")
+
+    @staticmethod
+    def measure(func, repeat: int) -> float:
+        return min(timeit.repeat(func, number=1, repeat=repeat))
@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.collector import collect_orphaned_thumbnails
+
+
+
+class Command(BaseCommand):
+    help = "Delete thumbnails that are no longer available in their owners' tiers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=settings.THUMBNAIL_GC_GRACE_PERIOD, help="Seconds thumbnail has to stay unavailable before it's deleted")
+        parser.add_argument("--batch-size", type=int, default=settings.THUMBNAIL_GC_BATCH_SIZE, help="Thumbnails deleted in one transaction")
+        parser.add_argument("--loop", type=float, default=None, metavar="SECONDS", help="Keep running, collect every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, freed = collect_orphaned_thumbnails(options["grace"], options["batch_size"])
+            self.stdout.write(f"Deleted {deleted} thumbnails, reclaimed {freed / 2**20:.1f} MiB")
+            if options["loop"] is None:
+                return
+            time.sleep(options["loop"])
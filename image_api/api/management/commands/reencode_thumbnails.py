@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.reencoder import reencode_thumbnails
+
+
+
+class Command(BaseCommand):
+    help = "Re-encode thumbnails rendered with other encoder profile than their target one (e.g. size-optimised pass after fast upload)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.REENCODE_BATCH_SIZE, help="Thumbnails re-encoded in one transaction")
+        parser.add_argument("--loop", type=float, default=None, metavar="SECONDS", help="Keep running, re-encode every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            reencoded = reencode_thumbnails(options["batch_size"])
+            self.stdout.write(f"Re-encoded {reencoded} thumbnails")
+            if options["loop"] is None:
+                return
+            time.sleep(options["loop"])
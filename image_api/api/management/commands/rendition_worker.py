@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import process_next_backfill_job, process_next_rendition_job
+
+
+
+class Command(BaseCommand):
+    help = "Render thumbnails waiting in the rendition queue and process backfill jobs (uploads go first)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            if not (process_next_rendition_job() or process_next_backfill_job()):
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
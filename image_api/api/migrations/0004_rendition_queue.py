@@ -0,0 +1,37 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_tier_available_heights'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending')], default='ready', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='RenditionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.IntegerField(default=1)),
+                ('fair_rank', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('thumbnail', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='api.uploadedimage')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='renditionjob',
+            index=models.Index(fields=['priority', 'fair_rank', 'id'], name='api_renditi_priorit_ef5658_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_rendition_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='lazy_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending'), ('lazy', 'Lazy')], default='ready', max_length=16),
+        ),
+    ]
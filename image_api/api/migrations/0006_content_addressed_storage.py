@@ -0,0 +1,27 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_lazy_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('references', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('heights', models.JSONField(default=list)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='uploadedimage',
+            constraint=models.UniqueConstraint(fields=('parent', 'height'), name='unique_thumbnail_height'),
+        ),
+        migrations.AddField(
+            model_name='backfilljob',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
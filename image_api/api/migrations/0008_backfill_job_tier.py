@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_backfill_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backfilljob',
+            name='tier',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.tier'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_backfill_job_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='orphaned_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
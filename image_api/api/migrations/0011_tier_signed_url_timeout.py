@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_image_path_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='signed_url_timeout',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_tier_signed_url_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='format',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='modified_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:40
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_image_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='lazy_variants',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='variant_formats',
+            field=models.CharField(blank=True, default='', max_length=64, validators=[api.models.validate_variant_formats]),
+        ),
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=16)),
+                ('image', models.FileField(max_length=255, upload_to='')),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('thumbnail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='api.uploadedimage')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='imagevariant',
+            constraint=models.UniqueConstraint(fields=('thumbnail', 'format'), name='unique_variant_format'),
+        ),
+    ]
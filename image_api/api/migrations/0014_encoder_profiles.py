@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:44
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availableheight',
+            name='encoder_profile',
+            field=models.CharField(blank=True, default='', max_length=32, validators=[api.models.validate_encoder_profile]),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='encoder_profile',
+            field=models.CharField(blank=True, default='', max_length=32, validators=[api.models.validate_encoder_profile]),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='profile',
+            field=models.CharField(blank=True, default='default', max_length=32),
+        ),
+    ]
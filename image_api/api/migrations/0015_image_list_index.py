@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_encoder_profiles'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['owner', 'id'], name='image_owner_list_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_image_list_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backfilljob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='backfilljob',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 21:29
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_backfill_job_attempts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='image',
+            field=models.ImageField(db_index=True, height_field='height', max_length=255, upload_to=api.models.UploadedImage.upload_to),
+        ),
+    ]
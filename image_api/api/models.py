@@ -1,11 +1,28 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 import uuid
+import hashlib
+from collections import Counter
+from dataclasses import dataclass
 import os
-from .utils import delete_file
 from django.core.exceptions import ValidationError
-from .utils import get_resized_image
+from django.conf import settings
+from django.utils import timezone
+from .utils import get_resized_images, replace_file, get_content_hash, get_content_type, get_image_format, get_encoders, transcode_image
+from .cache import get_or_compute, invalidate
+from .binary import precompute_binary_images
+
+
+def validate_encoder_profile(value) -> None:
+    """
+    Profile has to be defined in ENCODER_PROFILES setting
+    """
+    if value and value not in settings.ENCODER_PROFILES:
+        raise ValidationError(f"Unknown encoder profile: {value}! Available: {', '.join(settings.ENCODER_PROFILES)}.")
 
 
 class AvailableHeight(models.Model):
@@ -21,6 +38,34 @@ class AvailableHeight(models.Model):
         return f"Height: {self.height}px"
 
     height = models.IntegerField(validators=[MinValueValidator(10), deny_base_height], unique=True)      # available height of the image, minimum height is 10px
+    encoder_profile = models.CharField(max_length=32, blank=True, default="", validators=[validate_encoder_profile])   # profile of thumbnails in this height (see ENCODER_PROFILES setting), empty = tier's
+
+    @classmethod
+    def get_profiles(cls, heights) -> dict[int, str]:
+        """
+        Encoder profiles set for given heights, heights without profile are skipped
+        """
+        return dict(cls.objects.filter(height__in=heights).exclude(encoder_profile="").values_list("height", "encoder_profile"))
+
+
+def validate_variant_formats(value) -> None:
+    """
+    Only modern formats are served as variants of thumbnails
+    """
+    for img_format in value.upper().replace(" ", "").split(","):
+        if img_format and img_format not in ("WEBP", "AVIF"):
+            raise ValidationError(f"Unsupported format: {img_format}! Must be WEBP or AVIF.")
+
+
+@dataclass(frozen=True)
+class TierCapabilities:
+    """
+    What users of a tier can get (defaults = basic tier), cached in every process (see Tier.get_capabilities)
+    """
+    binary_image: bool = False
+    original_image: bool = False
+    extra_image_sizes: tuple[int, ...] = ()
+    signed_url_timeout: int | None = None
 
 
 class Tier(models.Model):
@@ -28,76 +73,607 @@ class Tier(models.Model):
     binary_image = models.BooleanField(default=False, null=False)           # is binary image available?
     original_image = models.BooleanField(default=False, null=False)         # is original image available?
     available_heights = models.ManyToManyField(to=AvailableHeight, blank=True)          # available image heights (different idea => ArrayField => worse portability(only Postgres))
+    lazy_thumbnails = models.BooleanField(default=False, null=False)        # are extra heights rendered only on the first download? (200px is always rendered at once)
+    signed_url_timeout = models.PositiveIntegerField(null=True, blank=True)  # how long signed links to images are valid (seconds), null = SIGNED_URL_TIMEOUT
+    variant_formats = models.CharField(max_length=64, blank=True, default="", validators=[validate_variant_formats])   # e.g. "AVIF,WEBP" - thumbnails also served in these formats (in order of preference) to clients accepting them
+    lazy_variants = models.BooleanField(default=True, null=False)           # are variants in other formats rendered only on the first download accepting them?
+    encoder_profile = models.CharField(max_length=32, blank=True, default="", validators=[validate_encoder_profile])   # profile of thumbnails (see ENCODER_PROFILES setting), empty = ENCODER_PROFILE
 
     def __str__(self) -> str:
         return f"{self.name}"
 
+    @property
+    def variant_format_list(self) -> list[str]:
+        """
+        Formats of thumbnail variants, only these which can be encoded (see utils.get_encoders)
+        """
+        encoders = get_encoders()
+        return [f for f in self.variant_formats.upper().replace(" ", "").split(",") if f in encoders]
+
     @property
     def extra_image_sizes(self) -> list[int]:
         """
         Returns list of available image height (in active tier), 
         200px is not included as it is always available in Basic Tier
         """
-        query = self.available_heights.all().values_list("height", flat=True)
-        return list(query)
+        return [h.height for h in self.available_heights.all()]    # uses prefetched heights if there are any
+
+    @classmethod
+    def get_capabilities(cls, tier_id: int | None) -> TierCapabilities:
+        """
+        Capabilities of the tier (None = basic tier), cached in process memory and the shared cache
+        until any tier or height changes - it bumps "tiers" generation (see api.signals), 
+        other processes notice it after LOCAL_CACHE_TIMEOUT seconds
+        """
+        if tier_id is None:
+            return TierCapabilities()
+        return get_or_compute(f"tier_capabilities:{tier_id}", ["tiers"], lambda: cls.compute_capabilities(tier_id), settings.TIER_CACHE_TIMEOUT)
+
+    @classmethod
+    def compute_capabilities(cls, tier_id: int) -> TierCapabilities:
+        tier = cls.objects.filter(pk=tier_id).first()
+        if tier is None:
+            return TierCapabilities()       # deleted in the meantime, users are moved to basic tier
+        return TierCapabilities(
+            binary_image=tier.binary_image,
+            original_image=tier.original_image,
+            extra_image_sizes=tuple(tier.available_heights.values_list("height", flat=True)),
+            signed_url_timeout=tier.signed_url_timeout,
+        )
 
 
 class User(AbstractUser):
     tier = models.ForeignKey(to=Tier, default=None, null=True, blank=True, on_delete=models.SET_NULL)   # null = basic tier
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, null=False)
 
+    @property
+    def tier_capabilities(self) -> TierCapabilities:
+        return Tier.get_capabilities(self.tier_id)
+
     def save(self, *args, **kwargs) -> None:
         """
-        Overriden to generate thumbnails when tier changes
+        Overriden to generate thumbnails when tier changes,
+        they are created by a backfill job (in the background if RENDITION_QUEUE is on)
         """
+        unavailable_res = set()
         # if saving existing object
         if not self._state.adding:
             # compare current resolutions with old ones (still stored in db)
-            old_data = User.objects.get(pk=self.pk)
-            previous_resolutions = [] if old_data.tier is None else old_data.tier.extra_image_sizes
+            old_tier_id = User.objects.filter(pk=self.pk).values_list("tier_id", flat=True).first()
+            previous_resolutions = Tier.get_capabilities(old_tier_id).extra_image_sizes
 
             # check if there's any tier at all (no tier = Basic tier)
-            if self.tier:
-                new_res = set(self.tier.extra_image_sizes)              # currently available resolutions
+            if self.tier_id:
+                new_res = set(self.tier_capabilities.extra_image_sizes)     # currently available resolutions
                 old_res = set(previous_resolutions)        # previously available resolutions
-                if new_res != old_res:
-                    unavailable_res = new_res.difference(old_res)
-                    for res in unavailable_res:
-                        images = self.uploadedimage_set.filter(parent=None)     # all original images
-                        for img in images:
-                            # check if image has thumbnail with requested size (maybe user returned to previous tier and file already exists)
-                            if res not in img.uploadedimage_set.all().values_list("height", flat=True):
-                                UploadedImage.objects.create(
-                                    image = get_resized_image(img.image, res),
-                                    owner = img.owner,
-                                    title = img.title,
-                                    parent = img,
-                                )
+                unavailable_res = new_res.difference(old_res)
 
-        return super().save(*args, **kwargs)
+        super().save(*args, **kwargs)
+
+        if unavailable_res:
+            BackfillJob.start(heights=unavailable_res, user=self)
 
 
 
 class UploadedImage(models.Model):
     def upload_to(instance, filename):
-        new_filename = uuid.uuid4()
         ext = os.path.splitext(filename)[1]
+        if instance.storage_key:
+            return StoredFile.make_name(instance.storage_key, ext)
+        new_filename = uuid.uuid4()
         return f"{instance.owner.uuid}/{new_filename}{ext}"
 
     def get_title(instance, filename):
         return filename
 
-    def delete(self, *args, **kwargs):
-        delete_file(self.image.path)    # delete original image from storage
-        if not self.parent:
-            thumbnails = self.uploadedimage_set.all()
-            for t in thumbnails:
-                    delete_file(t.image.path)   # delete thumbnails' files:
-        return super().delete(*args, **kwargs)
+    @property
+    def storage_key(self) -> str:
+        """
+        Key of the file in content-addressed storage: hash of the original for originals,
+        (hash of the original, height, encoder profile) for thumbnails.
+        Empty for images uploaded before content-addressed storage
+        """
+        if not self.content_hash:
+            return ""
+        if self.parent_id is None:
+            return self.content_hash
+        return f"{self.content_hash}/{self.height}/{self.profile}"
+
+    @classmethod
+    def from_upload(cls, owner: User, upload) -> "UploadedImage":
+        """
+        Returns new (not saved yet) original image for the uploaded file.
+        File is moved to content-addressed storage, unless the same file was already uploaded
+        (then image.is_duplicate is True)
+        """
+        content_hash = getattr(upload, "content_hash", None) or get_content_hash(upload)
+        image = cls(owner=owner, title=upload.name, content_hash=content_hash)
+
+        stored = StoredFile.acquire(content_hash)
+        image.is_duplicate = stored is not None
+        if stored:
+            image.image.name = stored.name
+        else:
+            name = image.image.storage.save(cls.upload_to(image, upload.name), upload)
+            image.image.name = StoredFile.register(content_hash, name)
+
+        image_size = getattr(upload, "image_size", None)        # already read from the header by the upload handler
+        image.height = image_size[1] if image_size else image.image.height
+        image.format = getattr(upload, "image_format", None) or get_image_format(image.image)
+        image.modified_at = timezone.now()
+        return image
+
+    @property
+    def content_type(self) -> str:
+        return get_content_type(self.format, self.image.name)
+
+    @property
+    def etag(self) -> str:
+        """
+        Strong ETag of the file, files never change under the same name 
+        (and the same content-addressed file has the same ETag for everyone)
+        """
+        return f'"{hashlib.md5((self.storage_key or self.image.name).encode()).hexdigest()}"'
+
+    @property
+    def file_metadata(self) -> dict:
+        """
+        Metadata of the file for HTTP caching (see views.get_image)
+        """
+        return {
+            "content_type": self.content_type,
+            "etag": self.etag,
+            "modified": int(self.modified_at.timestamp()) if self.modified_at else None,
+        }
+
+    @property
+    def tier_thumbnail_sizes(self) -> list[int]:
+        """
+        Heights of all thumbnails available in owner's tier
+        """
+        # Basic tier - always 200px thumbnail, custom tier - all thumbnails
+        return [200, *Tier.get_capabilities(self.owner.tier_id).extra_image_sizes]
+
+    def eager_thumbnail_sizes(self, heights) -> list[int]:
+        """
+        Heights (from the given ones) rendered right away,
+        in tiers with lazy thumbnails that's only 200px, other heights are rendered on the first download
+        """
+        lazy = self.owner.tier is not None and self.owner.tier.lazy_thumbnails
+        return [h for h in heights if not lazy or h == 200]
+
+    def get_thumbnail_profiles(self, heights, height_profiles: dict = None) -> dict[int, str]:
+        """
+        Target encoder profile of thumbnails in given heights: profile of the height, owner's tier 
+        or ENCODER_PROFILE setting (height_profiles can be given, if they're already known)
+        """
+        if height_profiles is None:
+            height_profiles = AvailableHeight.get_profiles(heights)
+        tier_profile = self.owner.tier.encoder_profile if self.owner.tier else ""
+        return {h: height_profiles.get(h) or tier_profile or settings.ENCODER_PROFILE for h in heights}
+
+    def get_upload_profiles(self, heights, height_profiles: dict = None) -> dict[int, str]:
+        """
+        Encoder profiles used to render thumbnails first (latency-optimised, see UPLOAD_ENCODER_PROFILE setting),
+        they're re-encoded with target profiles later (see api.reencoder)
+        """
+        targets = self.get_thumbnail_profiles(heights, height_profiles)
+        return {h: settings.UPLOAD_ENCODER_PROFILE or profile for h, profile in targets.items()}
+
+    def create_thumbnails(self, heights, files: dict = None) -> list["UploadedImage"]:
+        """
+        Create thumbnails of the original image in all given heights,
+        rendered right away or by background workers, depending on RENDITION_QUEUE setting.
+        Already rendered files (e.g. rendered in advance by batch upload) can be given in files
+
+        In tiers with lazy thumbnails, extra heights are only allowed here - rendered on the first download
+        """
+        thumbnails = UploadedImage.add_thumbnails({self: heights})
+        if not settings.RENDITION_QUEUE:
+            self.render_thumbnails(thumbnails, files)
+        return thumbnails
+
+    @classmethod
+    def add_thumbnails(cls, missing: dict) -> list["UploadedImage"]:
+        """
+        Create entries for thumbnails of many originals at once, missing = {original: [heights]}
+
+        Files are not rendered here: thumbnails rendered right away are pending (and enqueued, if RENDITION_QUEUE is on),
+        in tiers with lazy thumbnails extra heights are lazy, thumbnails already rendered
+        for another upload of the same file (with the target or upload encoder profile) are ready.
+        Returns thumbnails that still have to be rendered
+        """
+        height_profiles = AvailableHeight.get_profiles({h for heights in missing.values() for h in heights})
+        thumbnails = []
+        for original, heights in missing.items():
+            eager_heights = original.eager_thumbnail_sizes(heights)
+            targets = original.get_thumbnail_profiles(heights, height_profiles)
+            upload_profiles = original.get_upload_profiles(heights, height_profiles)
+            for height in heights:
+                status = cls.Status.PENDING if height in eager_heights else cls.Status.LAZY
+                thumbnail = cls(owner=original.owner, title=original.title, parent=original, height=height, content_hash=original.content_hash, status=status, format=original.format)
+                for profile in dict.fromkeys([targets[height], upload_profiles[height]]):
+                    thumbnail.profile = profile
+                    stored = StoredFile.acquire(thumbnail.storage_key)
+                    if stored:
+                        thumbnail.image.name = stored.name
+                        thumbnail.status = cls.Status.READY
+                        thumbnail.modified_at = timezone.now()
+                        break
+                else:
+                    thumbnail.image.name = cls.upload_to(thumbnail, original.image.name)
+                thumbnails.append(thumbnail)
+
+        cls.objects.bulk_create(thumbnails)
+        for owner_id in {k.owner_id for k in thumbnails}:
+            invalidate(f"user:{owner_id}")      # bulk_create doesn't send post_save
+        thumbnails = [t for t in thumbnails if t.status == cls.Status.PENDING]
+        if settings.RENDITION_QUEUE:
+            RenditionJob.enqueue(thumbnails)
+        return thumbnails
+
+    def render_thumbnails(self, thumbnails, files: dict = None) -> None:
+        """
+        Render files of given thumbnails, original file is decoded only once for all of them
+
+        Thumbnails are locked while rendering and already rendered ones are skipped,
+        so concurrent renders of the same thumbnail (by workers or downloads) happen only once
+        """
+        with transaction.atomic():
+            thumbnails = list(
+                UploadedImage.objects.select_for_update()
+                .filter(pk__in=[t.pk for t in thumbnails])
+                .exclude(status=UploadedImage.Status.READY)
+            )
+            to_render = []
+            for thumbnail in thumbnails:
+                stored = StoredFile.acquire(thumbnail.storage_key)
+                if stored:
+                    # already rendered for another upload of the same file
+                    thumbnail.image.name = stored.name
+                    thumbnail.status = UploadedImage.Status.READY
+                    thumbnail.modified_at = timezone.now()
+                    thumbnail.save(update_fields=["image", "status", "modified_at"])
+                else:
+                    to_render.append(thumbnail)
+
+            profiles = {t.height: t.profile for t in to_render}
+            if to_render and (files is None or any(getattr(files.get(h), "profile", None) != p for h, p in profiles.items())):
+                files = get_resized_images(self.image, list(profiles), profiles)
+            for thumbnail in to_render:
+                replace_file(thumbnail.image.path, files[thumbnail.height])     # name stays the same, it may be already used in links
+                thumbnail.image.name = StoredFile.register(thumbnail.storage_key, thumbnail.image.name)
+                thumbnail.status = UploadedImage.Status.READY
+                thumbnail.modified_at = timezone.now()
+                thumbnail.save(update_fields=["image", "status", "modified_at"])
+
+        self.render_variants(thumbnails)
+        self.render_binary_images(thumbnails)
+
+    def render_binary_images(self, thumbnails) -> None:
+        """
+        Convert given (rendered) thumbnails, and the original if owner's tier allows it, 
+        to binary images in advance - if BINARY_CACHE_EAGER is on and owner's tier allows binary images
+        """
+        tier = Tier.get_capabilities(self.owner.tier_id)
+        if not settings.BINARY_CACHE_EAGER or not tier.binary_image:
+            return
+        images = [self, *thumbnails] if tier.original_image else thumbnails
+        precompute_binary_images([image.image.name for image in images])
+
+    def render_variants(self, thumbnails) -> None:
+        """
+        Render variants of given (rendered) thumbnails in formats of owner's tier, 
+        unless they're rendered on the first download (lazy variants)
+        """
+        tier = self.owner.tier
+        if tier is None or tier.lazy_variants:
+            return
+        for thumbnail in thumbnails:
+            for img_format in tier.variant_format_list:
+                ImageVariant.render(thumbnail, img_format)
+
 
+    class Status(models.TextChoices):
+        READY = "ready"
+        PENDING = "pending"     # waiting in the queue to be rendered
+        LAZY = "lazy"           # rendered on the first download
 
-    image = models.ImageField(upload_to=upload_to, height_field="height")
+    image = models.ImageField(upload_to=upload_to, height_field="height", db_index=True, max_length=255)     # files are served by their path
     title = models.TextField(null=False, blank=False)
     owner = models.ForeignKey(to=User, on_delete=models.CASCADE)        # user that uploaded image
     parent = models.ForeignKey("self", default=None, null=True, blank=True, on_delete=models.CASCADE)   # null = original picture
     height = models.IntegerField(default=0)     # automatically filled
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)     # is file rendered already?
+    content_hash = models.CharField(max_length=64, blank=True, default="")     # SHA-256 of the original file
+    orphaned_at = models.DateTimeField(null=True, blank=True, default=None)    # since when no tier of the owner allows the thumbnail (see api.collector)
+    profile = models.CharField(max_length=32, blank=True, default="default")   # encoder profile the thumbnail file was rendered with (see ENCODER_PROFILES setting)
+    format = models.CharField(max_length=16, blank=True, default="")            # file format (PIL name, e.g. JPEG), empty = guessed from the name
+    modified_at = models.DateTimeField(null=True, blank=True, default=None)    # when the file was written (null = before it was recorded)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["parent", "height"], name="unique_thumbnail_height")]
+        indexes = [models.Index(fields=["owner", "id"], condition=Q(parent=None), name="image_owner_list_idx")]     # listing originals (see api.pagination)
+
+
+
+class ImageVariant(models.Model):
+    """
+    Thumbnail encoded in another format (e.g. WebP), served instead of the thumbnail 
+    to clients accepting that format - under the same URL (see views.get_image)
+
+    Variant exists only when its file is rendered: together with the thumbnail 
+    or on the first download accepting its format, depending on owner's tier
+    """
+    thumbnail = models.ForeignKey(to=UploadedImage, on_delete=models.CASCADE, related_name="variants")
+    format = models.CharField(max_length=16)        # PIL name, e.g. WEBP
+    image = models.FileField(max_length=255)
+    modified_at = models.DateTimeField(default=timezone.now)    # when the file was written
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["thumbnail", "format"], name="unique_variant_format")]
+
+    @property
+    def storage_key(self) -> str:
+        key = self.thumbnail.storage_key
+        return f"{key}/{self.format.lower()}" if key else ""
+
+    @property
+    def file_metadata(self) -> dict:
+        """
+        Metadata of the file for HTTP caching (see views.get_image)
+        """
+        return {
+            "name": self.image.name,
+            "content_type": get_content_type(self.format, self.image.name),
+            "etag": f'"{hashlib.md5((self.storage_key or self.image.name).encode()).hexdigest()}"',
+            "modified": int(self.modified_at.timestamp()),
+        }
+
+    @classmethod
+    def render(cls, thumbnail: UploadedImage, img_format: str) -> "ImageVariant":
+        """
+        Returns variant of the (rendered) thumbnail in given format, its file is rendered if needed
+        (or taken from content-addressed storage)
+        """
+        variant = cls.objects.filter(thumbnail=thumbnail, format=img_format).first()
+        if variant:
+            return variant
+
+        variant = cls(thumbnail=thumbnail, format=img_format)
+        key = variant.storage_key
+        stored = StoredFile.acquire(key)
+        if stored:
+            variant.image.name = stored.name
+        else:
+            ext = f".{img_format.lower()}"
+            variant.image.name = StoredFile.make_name(key, ext) if key else f"{os.path.splitext(thumbnail.image.name)[0]}{ext}"
+            replace_file(variant.image.path, ContentFile(transcode_image(thumbnail.image.path, img_format, thumbnail.profile)))
+            if key:
+                variant.image.name = StoredFile.register(key, variant.image.name)
+
+        try:
+            with transaction.atomic():
+                variant.save()
+        except IntegrityError:
+            # rendered by a concurrent download in the meantime, the same file is used
+            if key:
+                StoredFile.release([variant.image.name])
+            variant = cls.objects.get(thumbnail=thumbnail, format=img_format)
+        return variant
+
+
+
+class RenditionJob(models.Model):
+    """
+    Thumbnail waiting to be rendered by a background worker (manage.py rendition_worker)
+
+    Jobs are taken in order of priority (200px thumbnails first) and fair rank,
+    which is the number of jobs user had already waiting at the moment of enqueueing,
+    so users' jobs are interleaved and one heavy uploader can't starve everyone else
+    """
+    BASE_PRIORITY = 0       # 200px thumbnails
+    EXTRA_PRIORITY = 1      # other sizes
+
+    thumbnail = models.OneToOneField(to=UploadedImage, on_delete=models.CASCADE)
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    priority = models.IntegerField(default=EXTRA_PRIORITY)
+    fair_rank = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["priority", "fair_rank", "id"])]
+
+    def __str__(self) -> str:
+        return f"Rendition job: {self.thumbnail.height}px of {self.thumbnail.parent_id}"
+
+    @classmethod
+    def enqueue(cls, thumbnails) -> list["RenditionJob"]:
+        """
+        Add rendering jobs for given (pending) thumbnails
+        """
+        ranks = {}
+        jobs = []
+        for thumbnail in thumbnails:
+            if thumbnail.owner_id not in ranks:
+                ranks[thumbnail.owner_id] = cls.objects.filter(owner_id=thumbnail.owner_id).count()
+            jobs.append(cls(
+                thumbnail=thumbnail,
+                owner_id=thumbnail.owner_id,
+                priority=cls.BASE_PRIORITY if thumbnail.height == 200 else cls.EXTRA_PRIORITY,
+                fair_rank=ranks[thumbnail.owner_id],
+            ))
+            ranks[thumbnail.owner_id] += 1
+        return cls.objects.bulk_create(jobs)
+
+
+
+
+class BackfillJob(models.Model):
+    """
+    Creating missing thumbnails of many images (after tier change or tier extend), in chunks
+
+    Originals are processed in order of id, cursor keeps the last processed one,
+    so job interrupted in the middle resumes where it stopped (thumbnails and cursor are saved in one transaction).
+    Processed by background workers (manage.py rendition_worker) if RENDITION_QUEUE is on
+    """
+    user = models.ForeignKey(to=User, null=True, blank=True, on_delete=models.CASCADE)     # images of the user
+    tier = models.ForeignKey(to=Tier, null=True, blank=True, on_delete=models.CASCADE)     # or images of all users in the tier
+    heights = models.JSONField(default=list)                # heights of thumbnails to create
+    cursor = models.BigIntegerField(default=0)              # id of the last processed original
+    processed = models.IntegerField(default=0)              # number of processed originals
+    total = models.IntegerField(default=0)                  # number of originals to process
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)               # failed attempts of the current chunk, job is abandoned after BACKFILL_JOB_MAX_ATTEMPTS
+    last_error = models.TextField(blank=True, default="")
+
+    def __str__(self) -> str:
+        return f"Backfill {self.heights} of {self.user or self.tier}: {self.processed}/{self.total}"
+
+    @classmethod
+    def start(cls, heights, **scope) -> "BackfillJob | None":
+        """
+        Create job for given heights and scope (user=... or tier=...), run it right away if RENDITION_QUEUE is off.
+        Job isn't created if there are no images in the scope
+        """
+        job = cls(heights=sorted(heights), **scope)
+        job.total = job.get_originals().count()
+        if not job.total:
+            return None
+        job.save()
+        if not settings.RENDITION_QUEUE:
+            job.run()
+        return job
+
+    def get_originals(self):
+        """
+        Original images in job's scope
+        """
+        originals = UploadedImage.objects.filter(parent=None)
+        if self.tier_id:
+            return originals.filter(owner__tier=self.tier_id)
+        return originals.filter(owner=self.user_id)
+
+    @property
+    def progress(self) -> str:
+        if self.finished_at:
+            return "100%"
+        return f"{100 * self.processed // max(self.total, 1)}%"
+
+    def run_chunk(self) -> list[UploadedImage]:
+        """
+        Create missing thumbnails of the next chunk of originals (BACKFILL_CHUNK_SIZE),
+        marks job as finished if there's nothing left. Should be called in a transaction
+
+        Missing (image, height) pairs are found by one query, with NOT EXISTS for every height,
+        all thumbnails are inserted at once. Returns thumbnails that still have to be rendered
+        """
+        has_heights = {f"has_{h}": models.Exists(UploadedImage.objects.filter(parent=models.OuterRef("pk"), height=h)) for h in self.heights}
+        originals = list(
+            self.get_originals().filter(pk__gt=self.cursor).select_related("owner__tier")
+            .annotate(**has_heights).order_by("pk")[:settings.BACKFILL_CHUNK_SIZE]
+        )
+        if not originals:
+            self.finished_at = timezone.now()
+            self.save(update_fields=["finished_at"])
+            return []
+
+        missing = {original: [h for h in self.heights if not getattr(original, f"has_{h}")] for original in originals}
+        thumbnails = UploadedImage.add_thumbnails({original: heights for original, heights in missing.items() if heights})
+        self.cursor = originals[-1].pk
+        self.processed += len(originals)
+        self.save(update_fields=["cursor", "processed"])
+        return thumbnails
+
+    def run(self) -> None:
+        """
+        Process the whole job, thumbnails are rendered after every chunk, outside of its transaction
+        """
+        while self.finished_at is None:
+            with transaction.atomic():
+                thumbnails = self.run_chunk()
+            originals = {}
+            for thumbnail in thumbnails:
+                originals.setdefault(thumbnail.parent, []).append(thumbnail)
+            for original, original_thumbnails in originals.items():
+                original.render_thumbnails(original_thumbnails)
+
+
+
+class StoredFile(models.Model):
+    """
+    File in content-addressed storage, shared by all images with the same content
+
+    Every rendered image using the file holds one reference,
+    file is deleted from storage when the last reference is released (see api.reaper)
+    """
+    key = models.CharField(max_length=255, unique=True)        # see UploadedImage.storage_key
+    name = models.CharField(max_length=255, unique=True)       # name of the file in storage
+    references = models.PositiveIntegerField(default=1)
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.references} references)"
+
+    @staticmethod
+    def make_name(key: str, ext: str) -> str:
+        """
+        Returns new name of the file for given key, e.g. cas/ab/abcd..._400_default_1a2b3c4d.jpg
+
+        Every name is unique, so a file rendered again for the key never overwrites
+        the released one, which is deleted from storage only after its row (see api.reaper)
+        """
+        return f"cas/{key[:2]}/{key.replace('/', '_')}_{uuid.uuid4().hex[:8]}{ext}"
+
+    @classmethod
+    def acquire(cls, key: str) -> "StoredFile | None":
+        """
+        Add reference to the file with given key, returns None if there's no such file
+        """
+        if key and cls.objects.filter(key=key).update(references=F("references") + 1):
+            return cls.objects.get(key=key)
+        return None
+
+    @classmethod
+    def register(cls, key: str, name: str) -> str:
+        """
+        Add just saved file to the storage, with one reference.
+        Returns name of the file that should be used - if the same file was saved concurrently,
+        the other one is used and just saved file is deleted
+        """
+        if not key:
+            return name
+        while True:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(key=key, name=name)
+                return name
+            except IntegrityError:
+                stored = cls.acquire(key)
+                if stored:
+                    if stored.name != name:
+                        default_storage.delete(name)
+                    return stored.name
+
+    @classmethod
+    def release(cls, names: list[str]) -> list[str]:
+        """
+        Drop references to the files, one for every occurrence of the name.
+        Returns names of files that should be deleted from storage - without references left
+        and files stored before content-addressed storage
+        """
+        counts = Counter(names)
+        with transaction.atomic():
+            # rows are locked until they're deleted, so concurrent acquire can't reuse a file that is going to be deleted
+            stored = set(cls.objects.select_for_update().filter(name__in=counts).order_by("pk").values_list("name", flat=True))
+            by_count = {}
+            for name in stored:
+                by_count.setdefault(counts[name], []).append(name)
+            for count, count_names in by_count.items():
+                cls.objects.filter(name__in=count_names).update(references=F("references") - count)
+
+            unused = dict(cls.objects.filter(name__in=stored, references__lte=0).values_list("pk", "name"))
+            cls.objects.filter(pk__in=unused).delete()
+        return list(unused.values()) + [name for name in counts if name not in stored]
\ No newline at end of file
@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Keyset pagination of images - newest first, next page starts after the last id of the previous one,
+    so deep pages cost the same as the first (index on owner and id of originals, see UploadedImage.Meta)
+
+    Returns {"next": <url with opaque cursor>, "previous": <url>, "results": [...]},
+    links are relative (without the Host header of the request), so the same page can be cached for all hosts
+    """
+    ordering = "-id"
+    page_size = settings.IMAGE_LIST_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.IMAGE_LIST_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super().paginate_queryset(queryset, request, view)
+        self.base_url = request.get_full_path()
+        return page
@@ -1,6 +1,8 @@
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.http import Http404
 from rest_framework import permissions
 
+from .cache import get_or_compute
 from .models import UploadedImage
 
 
@@ -20,24 +22,62 @@ class CheckImagePermission(permissions.BasePermission):
         if not image_path:
             return False        # if there's no argument 'image_path', deny access
 
-        image_object = get_object_or_404(UploadedImage, image=image_path)
-
-        # check if user is an owner of the photo
-        if image_object.owner == request.user:
-            # 200px thumbnails are always available:
-            if image_object.height == 200: return True     
-            
-            user_tier = request.user.tier
-            if user_tier:
-                # request for original photo
-                if image_object.parent is None:
-                    return user_tier.original_image     # grant access if proper tier
-                else:
-                    # different sizes has to be checked
-                    return image_object.height in user_tier.extra_image_sizes   # access depends on tier
-
-        return False    # deny access if it hasn't been already given
-            
+        access = get_image_access(request.user, image_path)
+        if not access["found"]:
+            raise Http404
+        request.image_access = access       # reused by the view
+        return access["allowed"]
+
+
+def get_image_access(user, image_path: str) -> dict:
+    """
+    Decision if user can see the image file, cached until user's images, user or tiers change (see api.signals)
+
+    Returns {"found": <user has an image with the file>, "allowed": ..., "pk": <user's image id>, "status": <user's image status>, 
+        "content_type": ..., "etag": ..., "modified": <timestamp of the file>,
+        "formats": <formats of variants, in order of preference>, "variants": {<format>: <variant's file metadata>}}
+    """
+    return get_or_compute(
+        f"image_access:{user.pk}:{user.tier_id}:{image_path}",
+        [f"user:{user.pk}", "tiers"],
+        lambda: compute_image_access(user, image_path),
+        settings.IMAGE_ACCESS_CACHE_TIMEOUT,
+    )
+
+
+def compute_image_access(user, image_path: str) -> dict:
+    # the same file can be shared by images of many users (content-addressed storage),
+    # names of files can be computed from their content - other users can't learn if anybody has the file (404 for all)
+    image_object = UploadedImage.objects.filter(image=image_path, owner=user).first()
+    if image_object is None:
+        return {"found": False, "allowed": False, "pk": None, "status": None}     # not an owner of the photo
+    return {
+        "found": True,
+        "allowed": has_image_access(user, image_object),
+        "pk": image_object.pk,
+        "status": image_object.status,
+        **image_object.file_metadata,
+        # thumbnail can be served in other formats (see views.get_image):
+        "formats": user.tier.variant_format_list if user.tier and image_object.parent_id else [],
+        "variants": {v.format: v.file_metadata for v in image_object.variants.all()} if image_object.parent_id else {},
+    }
+
+
+def has_image_access(user, image_object: UploadedImage) -> bool:
+    """
+    Check if user has rights to see image of this size (owner is already checked)
+    """
+    # 200px thumbnails are always available:
+    if image_object.height == 200: return True
+
+    user_tier = user.tier_capabilities     # basic tier grants nothing more
+    # request for original photo
+    if image_object.parent_id is None:
+        return user_tier.original_image     # grant access if proper tier
+    else:
+        # different sizes has to be checked
+        return image_object.height in user_tier.extra_image_sizes   # access depends on tier
+
 
 class CheckBinaryPermission(permissions.BasePermission):
     """
@@ -47,7 +87,4 @@ class CheckBinaryPermission(permissions.BasePermission):
         if request.user and request.user.is_staff:       # admins have rights to see everything
             return True
 
-        if request.user.tier:
-            return request.user.tier.binary_image
-        else:
-            return False
+        return request.user.tier_capabilities.binary_image     # cached, see Tier.get_capabilities
@@ -0,0 +1,78 @@
+import threading
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from .models import ImageVariant, StoredFile, UploadedImage
+from .utils import delete_files
+
+
+
+_local = threading.local()
+
+
+class ReleaseBatch:
+    """
+    Files of images deleted in one transaction (savepoint),
+    released and deleted from storage in batches, after the transaction is committed
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.savepoint_ids = set(connection.savepoint_ids)
+        self.names = []
+        self.flushed = False
+
+    def is_pending(self) -> bool:
+        """
+        Batch still waits for commit of the current transaction (savepoint),
+        not executed yet, nor discarded by a rollback
+        """
+        if self.flushed:
+            return False
+        return self.savepoint_ids == set(self.connection.savepoint_ids) and any(func == self.flush for _, func in self.connection.run_on_commit)
+
+    def flush(self) -> None:
+        self.flushed = True
+        batch_size = settings.FILE_REAPER_BATCH_SIZE
+        for i in range(0, len(self.names), batch_size):
+            unused = StoredFile.release(self.names[i:i + batch_size])
+            _local.freed_bytes = freed_bytes() + delete_files([default_storage.path(name) for name in unused])
+
+
+def release_image_file(sender, instance, **kwargs):
+    """
+    Release file of every deleted image (or its variant), no matter how it was deleted (model, queryset, cascade from original or user).
+    Only rendered images hold a reference to their file
+    """
+    if sender is UploadedImage and instance.status != UploadedImage.Status.READY:
+        return
+
+    release_later(instance.image.name)
+
+
+def release_later(name: str) -> None:
+    """
+    Release file after the current transaction is committed (deleted from storage if it was the last reference)
+    """
+    connection = transaction.get_connection()
+    batch = getattr(_local, "batch", None)
+    if batch is None or batch.connection is not connection or not batch.is_pending():
+        batch = _local.batch = ReleaseBatch(connection)
+        batch.names.append(name)
+        transaction.on_commit(batch.flush)      # outside of a transaction it's executed right away
+    else:
+        batch.names.append(name)
+
+
+def freed_bytes() -> int:
+    """
+    Number of bytes freed by the reaper in the current thread so far
+    """
+    return getattr(_local, "freed_bytes", 0)
+
+
+
+post_delete.connect(release_image_file, sender=UploadedImage)
+post_delete.connect(release_image_file, sender=ImageVariant)
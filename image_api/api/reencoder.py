@@ -0,0 +1,103 @@
+import logging
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from . import reaper
+from .models import AvailableHeight, StoredFile, UploadedImage
+from .utils import get_resized_images, replace_file
+
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_outdated_thumbnails():
+    """
+    Rendered thumbnails encoded with other profile than their target one - profile of the height, owner's tier
+    or ENCODER_PROFILE setting (e.g. rendered with UPLOAD_ENCODER_PROFILE first, or profile of the tier changed)
+    """
+    height_profile = AvailableHeight.objects.filter(height=OuterRef("height")).values("encoder_profile")[:1]
+    target_profile = Coalesce(
+        NullIf(Subquery(height_profile), Value("")),
+        NullIf(F("owner__tier__encoder_profile"), Value("")),
+        Value(settings.ENCODER_PROFILE),
+    )
+    return (
+        UploadedImage.objects.exclude(parent=None)
+        .filter(status=UploadedImage.Status.READY)
+        .annotate(target_profile=target_profile)
+        .exclude(profile=F("target_profile"))
+    )
+
+
+def reencode_thumbnail(thumbnail: UploadedImage, file) -> None:
+    """
+    Replace file of the thumbnail with the file encoded with its target profile,
+    old file (and variants rendered from it) is released after commit
+    """
+    old_name = thumbnail.image.name
+    thumbnail.profile = thumbnail.target_profile
+    key = thumbnail.storage_key
+    stored = StoredFile.acquire(key)
+    if stored:
+        name = stored.name     # already re-encoded for another upload of the same file
+    else:
+        name = UploadedImage.upload_to(thumbnail, thumbnail.parent.image.name)
+        replace_file(default_storage.path(name), file)
+        if key:
+            name = StoredFile.register(key, name)
+
+    thumbnail.image.name = name
+    thumbnail.modified_at = timezone.now()
+    thumbnail.save(update_fields=["image", "profile", "modified_at"])
+    thumbnail.variants.all().delete()
+    reaper.release_later(old_name)
+
+
+def reencode_thumbnails(batch_size: int) -> int:
+    """
+    Re-encode outdated thumbnails with their target profiles, in batches of batch_size,
+    every original is decoded once for all its thumbnails in the batch
+
+    Returns number of re-encoded thumbnails
+    """
+    reencoded, failed = 0, []
+    while True:
+        rendered = []
+        with transaction.atomic():
+            thumbnails = list(
+                get_outdated_thumbnails().exclude(pk__in=failed)
+                .select_for_update(skip_locked=True, of=("self",))
+                .select_related("parent__owner__tier")
+                .order_by("parent_id")[:batch_size]
+            )
+            if not thumbnails:
+                break
+
+            originals = {}
+            for thumbnail in thumbnails:
+                originals.setdefault(thumbnail.parent_id, []).append(thumbnail)
+            for group in originals.values():
+                original = group[0].parent
+                profiles = {t.height: t.target_profile for t in group}
+                try:
+                    with transaction.atomic():
+                        files = get_resized_images(original.image, list(profiles), profiles)
+                        for thumbnail in group:
+                            reencode_thumbnail(thumbnail, files[thumbnail.height])
+                except Exception:
+                    logger.exception("Re-encoding thumbnails of image %s failed", original.pk)
+                    failed += [t.pk for t in group]
+                    continue
+                rendered.append((original, group))
+                reencoded += len(group)
+
+        for original, group in rendered:
+            original.render_variants(group)     # eager variants of new files
+
+    return reencoded
@@ -0,0 +1,20 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:     # optional, standard json module is used without it
+    orjson = None
+
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Compact JSON rendered with orjson (several times faster than json module) if it's installed,
+    indented output (e.g. Accept: application/json; indent=4) is still rendered by DRF
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        content = orjson.dumps(data, default=self.encoder_class().default)
+        # the same escaping as DRF's - these are valid in JSON, but not in JavaScript
+        return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
@@ -1,88 +1,170 @@
 from rest_framework import serializers
-from .models import UploadedImage
+from .models import TierCapabilities, UploadedImage
 from PIL import Image, UnidentifiedImageError
 from django.conf import settings
 from django.db.models import ImageField
-from rest_framework.reverse import reverse
+from django.utils.functional import cached_property
+from .signing import sign_url
+from .utils import reverse_path
 
 
 
 
 class ImageSerializerCreate(serializers.ModelSerializer):
+    image = serializers.FileField()     # not ImageField, it would decode whole file, validate_image checks the header only
+
     class Meta:
         model = UploadedImage
         fields = ["image"]
 
+    def to_internal_value(self, data):
+        """
+        Report files rejected while uploading (see api.uploads.ImageUploadHandler)
+        """
+        request = self.context.get("request")
+        upload_errors = getattr(request, "upload_errors", None)
+        if upload_errors:
+            raise serializers.ValidationError({field: [error for _, error in errors] for field, errors in upload_errors.items()})
+        return super().to_internal_value(data)
+
     def validate_image(self, value):
         """
         Image must be in PNG or JPEG format
         """
-        try:
-            img = Image.open(value)
-        except UnidentifiedImageError:
-            # PIL will raise that exception if file is not an image
-            raise serializers.ValidationError("Wrong image file! Probably not an image!")
-        except:
-            # couldn't load an image
-            raise serializers.ValidationError("Problem with loading image!")
+        image_format = getattr(value, "image_format", None)    # already read from the header by the upload handler
+
+        if image_format is None:
+            try:
+                with Image.open(value) as img:
+                    image_format = img.format
+            except UnidentifiedImageError:
+                # PIL will raise that exception if file is not an image
+                raise serializers.ValidationError("Wrong image file! Probably not an image!")
+            except:
+                # couldn't load an image
+                raise serializers.ValidationError("Problem with loading image!")
 
         # only PNG and JPEG allowed
-        if img.format not in ["JPEG", "PNG"]:
-            raise serializers.ValidationError(f"Unsupported image format! Must be JPEG or PNG, currently {img.format}.")
+        if image_format not in ["JPEG", "PNG"]:
+            raise serializers.ValidationError(f"Unsupported image format! Must be JPEG or PNG, currently {image_format}.")
 
         return value
 
 
+RESOLUTION_FIELDS = {"url", "binary", "status"}    # parts of every resolution of the image
+
+
 class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = UploadedImage
         fields = ["title"]
 
-    def get_full_image_address(self, image: ImageField) -> str:
+    prefetch_lookups = ["uploadedimage_set"]     # all thumbnails (tiers are cached, see Tier.get_capabilities)
+
+    @classmethod
+    def prefetch(cls, queryset):
+        """
+        Load everything needed to represent images of the queryset in constant number of queries
+        """
+        return queryset.select_related("owner").prefetch_related(*cls.prefetch_lookups)
+
+    @cached_property
+    def requested_fields(self) -> set[str] | None:
+        """
+        Parts of the representation chosen with GET parameter "fields" (None = all), e.g. ...?fields=title,resolutions.url
+        "resolutions" means all parts of every resolution, "resolutions.<part>" only the given part (url, binary, status)
+        """
+        return self.get_query_list("fields", {"title", "resolutions", *(f"resolutions.{part}" for part in RESOLUTION_FIELDS)})
+
+    @cached_property
+    def requested_sizes(self) -> set[str] | None:
+        """
+        Resolutions chosen with GET parameter "sizes" (None = all available), e.g. ...?sizes=200px,original
         """
-        Create full URL address to image
+        return self.get_query_list("sizes")
+
+    def get_query_list(self, param: str, choices: set[str] = None) -> set[str] | None:
+        request = self.context.get("request")
+        value = None if request is None else request.query_params.get(param)
+        if value is None:
+            return None
+        values = {v.strip() for v in value.split(",") if v.strip()}
+        if choices is not None and not values <= choices:
+            raise serializers.ValidationError({param: [f"Unknown {param}: {', '.join(sorted(values - choices))}! Must be any of: {', '.join(sorted(choices))}."]})
+        return values
+
+    def get_full_image_address(self, image: ImageField, signed: bool = False, tier: TierCapabilities = None) -> str:
+        """
+        Create full URL address to image, 
+        signed links (see api.signing) are served by nginx without asking the API
         """
         # return reverse("get_image", args=(image.name,))
-        return reverse("get_image", args=(image.name,))
+        if signed:
+            timeout = tier.signed_url_timeout if tier and tier.signed_url_timeout else settings.SIGNED_URL_TIMEOUT
+            return sign_url(reverse_path("get_signed_image", image.name), timeout)
+        return reverse_path("get_image", image.name)
 
-    def get_resolution_representation(self, image: ImageField, binary: bool) -> dict:
+    def get_resolution_representation(self, image: UploadedImage, binary: bool, tier: TierCapabilities = None, parts: set[str] = RESOLUTION_FIELDS) -> dict:
         """
         For given image return dict in format {
             "url": <url_to_image>, 
             "binary": <url_to_generate_binary_image>,   <== *optional 
+            "status": "ready",
             }
+        or {"status": "pending"} if image is still waiting to be rendered (or isn't created yet)
+        (lazy thumbnails are ready - they are rendered on the first download)
+        only given parts are included
         """
+        if image is None or image.status == UploadedImage.Status.PENDING:
+            return {"status": UploadedImage.Status.PENDING} if "status" in parts else {}
+
         temp = {}
 
-        temp["url"] = self.get_full_image_address(image.image)
-        if binary:
-            temp["binary"] = reverse("generate_binary_link", args=(image.image.name,))
+        # files of lazy thumbnails don't exist yet, they're rendered by the API on the first download:
+        if "url" in parts:
+            signed = settings.SIGNED_URLS and image.status == UploadedImage.Status.READY
+            temp["url"] = self.get_full_image_address(image.image, signed, tier)
+        if binary and "binary" in parts:
+            temp["binary"] = reverse_path("generate_binary_link", image.image.name)
+        if "status" in parts:
+            temp["status"] = UploadedImage.Status.READY
         return temp
 
 
     def to_representation(self, instance):
         """
-        Add links to all available for user resolutions
+        Add links to all available for user resolutions,
+        only requested fields and sizes are computed (see requested_fields, requested_sizes)
         """
-        data = super().to_representation(instance)  # default returned json
+        fields = self.requested_fields
+        sizes = self.requested_sizes
+        data = {"title": instance.title} if fields is None or "title" in fields else {}   # Meta.fields, without going through serializer fields
+        if fields is None or "resolutions" in fields:
+            parts = RESOLUTION_FIELDS
+        else:
+            parts = {f.split(".", 1)[1] for f in fields if f.startswith("resolutions.")}
+            if not parts:
+                return data
         resolutions = {}
 
-        binary_image = False if instance.owner.tier is None else instance.owner.tier.binary_image
+        user_tier = instance.owner.tier_capabilities
+        binary_image = user_tier.binary_image
+        thumbnails = {t.height: t for t in instance.uploadedimage_set.all()}    # one query, or none if prefetched (see prefetch)
         
         # always available 200px thumbnail
-        thumbnail = instance.uploadedimage_set.get(height=200)
-        resolutions["200px"] = self.get_resolution_representation(thumbnail, binary_image)
+        available = {"200px": thumbnails.get(200)}
         
-        # check user tier for more resolutions
-        user_tier = instance.owner.tier
-        if user_tier:
-            # user has rights to get original image
-            if user_tier.original_image:
-                resolutions["original"] = self.get_resolution_representation(instance, binary_image)
-            # return links to other thumbnail sizes
-            for t in instance.owner.tier.extra_image_sizes:
-                thumbnail = instance.uploadedimage_set.get(height=t)
-                resolutions[f"{t}px"] = self.get_resolution_representation(thumbnail, binary_image)
+        # check user tier for more resolutions (basic tier has none)
+        # user has rights to get original image
+        if user_tier.original_image:
+            available["original"] = instance
+        # return links to other thumbnail sizes (missing ones are still being backfilled)
+        for t in user_tier.extra_image_sizes:
+            available[f"{t}px"] = thumbnails.get(t)
+
+        for size, image in available.items():
+            if sizes is None or size in sizes:
+                resolutions[size] = self.get_resolution_representation(image, binary_image, user_tier, parts)
 
         data["resolutions"] = resolutions
-        return data
\ No newline at end of file
+        return data
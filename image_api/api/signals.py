@@ -1,6 +1,6 @@
-from django.db.models.signals import m2m_changed
-from .models import AvailableHeight, Tier, UploadedImage
-from .utils import get_resized_image
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from .cache import invalidate
+from .models import AvailableHeight, BackfillJob, ImageVariant, Tier, UploadedImage, User
 
 
 
@@ -8,22 +8,45 @@ def signal(sender, instance, **kwargs):
     """
     Handle tier extend - if new resolution is added to a tier, all images 
     in the tier have to be processed because new thumbnails have to be created
+    (by a backfill job, in the background if RENDITION_QUEUE is on)
     """
-    if kwargs["action"] == "pre_add":
-        pk = kwargs["pk_set"]       # get list of newly added heights
-        new_res = AvailableHeight.objects.filter(pk__in=pk).values_list("height", flat=True)    # new heights
-        for res in new_res:
-            images = UploadedImage.objects.filter(parent=None, owner__tier=instance)     # all original images
-            for img in images:
-                # check if image has thumbnail with requested size (maybe user had that height available in previous tier and file already exists)
-                if res not in img.uploadedimage_set.all().values_list("height", flat=True):
-                    UploadedImage.objects.create(
-                        image = get_resized_image(img.image, res),
-                        owner = img.owner,
-                        title = img.title,
-                        parent = img,
-                    )
-
-
-
-m2m_changed.connect(signal, sender=Tier.available_heights.through)
\ No newline at end of file
+    if kwargs["action"] == "post_add":
+        pk = kwargs["pk_set"]       # get list of newly added heights (or tiers, if added from the height's side)
+        if kwargs["reverse"]:
+            for tier in Tier.objects.filter(pk__in=pk):
+                BackfillJob.start(heights=[instance.height], tier=tier)
+        else:
+            new_res = AvailableHeight.objects.filter(pk__in=pk).values_list("height", flat=True)    # new heights
+            BackfillJob.start(heights=new_res, tier=instance)
+
+
+
+def invalidate_user(sender, instance, **kwargs):
+    """
+    Forget cached data of the user (e.g. decisions if images can be seen) after the user (tier) 
+    or any of their images (or variants) changed
+    """
+    if sender is ImageVariant:
+        invalidate(f"user:{instance.thumbnail.owner_id}")
+    else:
+        invalidate(f"user:{instance.owner_id if sender is UploadedImage else instance.pk}")
+
+
+def invalidate_tiers(sender, instance, **kwargs):
+    """
+    Forget cached data depending on tiers after any tier (or its heights) changed
+    """
+    if sender is not Tier.available_heights.through or kwargs["action"] in ("post_add", "post_remove", "post_clear"):
+        invalidate("tiers")
+
+
+
+m2m_changed.connect(signal, sender=Tier.available_heights.through)
+m2m_changed.connect(invalidate_tiers, sender=Tier.available_heights.through)
+for model in (Tier, AvailableHeight):
+    post_save.connect(invalidate_tiers, sender=model)
+    post_delete.connect(invalidate_tiers, sender=model)
+for model in (User, UploadedImage):
+    post_save.connect(invalidate_user, sender=model)
+    post_delete.connect(invalidate_user, sender=model)
+post_save.connect(invalidate_user, sender=ImageVariant)     # variants are deleted only with their thumbnails
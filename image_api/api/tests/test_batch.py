@@ -0,0 +1,133 @@
+from django.test import TestCase
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight, StoredFile
+from api.batch import read_limited
+from api.uploads import ImageRejected
+from django.db import DatabaseError
+from unittest.mock import patch
+from io import BytesIO
+import zipfile
+
+
+
+class TestBatchUpload(TestCase):
+    """
+    Test uploading many images in one request
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.tier.save()
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.login_data = {"username": "delilah", "password": "1234"}
+        self.test_image_dir = settings.BASE_DIR / "test_images"
+        self.images = ["cat1.jpg", "avatar1.png", "kiwka.gif"]
+
+    def test_batch_files(self):
+        """
+        All correct files should be created, wrong ones reported
+        """
+        self.client.login(**self.login_data)
+        files = [SimpleUploadedFile(image, open(self.test_image_dir / image, "rb").read()) for image in self.images]
+        response = self.client.post(reverse("images-batch"), data={"images": files})
+        self.assertEqual(response.status_code, 200)
+
+        results = {result["name"]: result for result in response.json()["results"]}
+        self.assertEqual(results["cat1.jpg"]["status"], "created")
+        self.assertEqual(results["avatar1.png"]["status"], "created")
+        self.assertEqual(results["kiwka.gif"]["status"], "rejected")
+        self.assertIn("400px", results["cat1.jpg"]["image"]["resolutions"])
+
+        originals = UploadedImage.objects.filter(parent=None)
+        self.assertCountEqual(["cat1.jpg", "avatar1.png"], [k.title for k in originals])
+        for original in originals:
+            self.assertCountEqual([200, 400], [k.height for k in original.uploadedimage_set.all()])
+            for thumbnail in original.uploadedimage_set.all():
+                self.assertEqual(thumbnail.image.height, thumbnail.height)
+
+    def test_batch_archive(self):
+        """
+        Images should be extracted from zip archive
+        """
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for image in self.images:
+                zip_file.write(self.test_image_dir / image, f"photos/{image}")
+            zip_file.writestr("notes.txt", "not an image")
+
+        self.client.login(**self.login_data)
+        response = self.client.post(reverse("images-batch"), data={"archive": SimpleUploadedFile("photos.zip", archive.getvalue())})
+        self.assertEqual(response.status_code, 200)
+
+        statuses = {result["name"]: result["status"] for result in response.json()["results"]}
+        self.assertEqual(statuses, {"cat1.jpg": "created", "avatar1.png": "created", "kiwka.gif": "rejected", "notes.txt": "rejected"})
+        self.assertEqual(UploadedImage.objects.filter(parent=None).count(), 2)
+        self.assertEqual(UploadedImage.objects.exclude(parent=None).count(), 4)
+
+    def test_batch_wrong_archive(self):
+        """
+        Archive that is not a zip file should be rejected
+        """
+        self.client.login(**self.login_data)
+        img = SimpleUploadedFile("cat1.zip", open(self.test_image_dir / "cat1.jpg", "rb").read())
+        response = self.client.post(reverse("images-batch"), data={"archive": img})
+        self.assertEqual(response.status_code, 400)
+
+    def make_archive(self, images) -> SimpleUploadedFile:
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for image in images:
+                zip_file.write(self.test_image_dir / image, image)
+        return SimpleUploadedFile("images.zip", archive.getvalue())
+
+    def test_archive_limits(self):
+        """
+        Entries over BATCH_MAX_FILE_SIZE, or over BATCH_MAX_ARCHIVE_SIZE together, should be rejected
+        """
+        self.client.login(**self.login_data)
+        with self.settings(BATCH_MAX_FILE_SIZE=100 * 1024, BATCH_MAX_ARCHIVE_SIZE=1024 * 1024):
+            response = self.client.post(reverse("images-batch"), data={"archive": self.make_archive(["cat1.jpg", "avatar1.png"])})
+        results = {result["name"]: result for result in response.json()["results"]}
+        self.assertEqual(results["cat1.jpg"]["status"], "created")
+        self.assertEqual(results["avatar1.png"]["error"], "File is too big!")
+
+        with self.settings(BATCH_MAX_ARCHIVE_SIZE=30 * 1024):
+            response = self.client.post(reverse("images-batch"), data={"archive": self.make_archive(["cat1.jpg", "cat1.jpg"])})
+        self.assertEqual([result["status"] for result in response.json()["results"]], ["created", "rejected"])
+        self.assertEqual(response.json()["results"][1]["error"], "Archive is too big!")
+
+    def test_archive_declared_size(self):
+        """
+        Entries should be limited while they're extracted, declared sizes can't be trusted
+        """
+        chunks = read_limited(BytesIO(b"x" * 1000), 999, "File is too big!")
+        with self.assertRaisesMessage(ImageRejected, "File is too big!"):
+            list(chunks)
+        self.assertEqual(b"".join(read_limited(BytesIO(b"x" * 1000), 1000, "File is too big!")), b"x" * 1000)
+
+    def test_insert_in_chunks(self):
+        """
+        Images should be inserted in chunks of BATCH_INSERT_SIZE
+        """
+        self.client.login(**self.login_data)
+        with self.settings(BATCH_INSERT_SIZE=1), patch.object(UploadedImage.objects, "bulk_create", wraps=UploadedImage.objects.bulk_create) as bulk_create:
+            response = self.client.post(reverse("images-batch"), data={"archive": self.make_archive(["cat1.jpg", "avatar1.png"])})
+        self.assertEqual([result["status"] for result in response.json()["results"]], ["created", "created"])
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list if call.args[0][0].parent is None], [1, 1])
+
+    def test_failed_insert(self):
+        """
+        Files of images which couldn't be inserted should be released
+        """
+        self.client.login(**self.login_data)
+        with self.captureOnCommitCallbacks(execute=True), patch.object(UploadedImage.objects, "bulk_create", side_effect=DatabaseError):
+            response = self.client.post(reverse("images-batch"), data={"archive": self.make_archive(["cat1.jpg"])})
+        self.assertEqual(response.json()["results"][0]["error"], "Problem with loading image!")
+        self.assertFalse(UploadedImage.objects.exists())
+        self.assertFalse(StoredFile.objects.exists())
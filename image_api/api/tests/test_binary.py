@@ -9,6 +9,12 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from api.models import UploadedImage, Tier, AvailableHeight
 from django.core.cache import cache
+from django.core.files.storage import default_storage
+from api.binary import evict_binary_images, get_binary_image, render_binary_image
+from api.binarization import BINARIZATION_MODES, binarize, get_otsu_threshold
+from unittest.mock import patch
+from PIL import Image
+from io import BytesIO
 import json
 
 class TestBinaryImages(TestCase):
@@ -154,3 +160,148 @@ class TestBinaryImages(TestCase):
 
         response = self.client.get(reverse("get_binary_image", args=(token,)))
         self.assertEqual(response.status_code, 404)     # unavailable
+
+
+    def get_binary_link(self, image: UploadedImage) -> str:
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        response = self.client.get(reverse("generate_binary_link", args=(image.image.name,)))
+        return json.loads(response.content)["binary_image"]
+
+    def test_binary_image_cache(self):
+        """
+        Binary image should be converted once, then served from disk
+        """
+        uploaded_image = UploadedImage.objects.get(height=200)
+        link = self.get_binary_link(uploaded_image)
+
+        response = self.client.get(link)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        content = b"".join(response.streaming_content)
+        with Image.open(BytesIO(content)) as img:
+            self.assertEqual(img.height, 200)
+
+        with patch("api.binary.render_binary_image") as render:
+            response = self.client.get(link)
+            self.assertEqual(b"".join(response.streaming_content), content)
+            render.assert_not_called()
+
+    def test_binary_image_deleted_source(self):
+        """
+        Cached binary image shouldn't be served after its source is deleted
+        """
+        thumbnail = UploadedImage.objects.get(height=200)
+        link = self.get_binary_link(thumbnail)
+        self.assertEqual(self.client.get(link).status_code, 200)
+        name, _ = get_binary_image(thumbnail.image.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            thumbnail.parent.delete()
+        self.assertFalse(default_storage.exists(thumbnail.image.name))
+        self.assertTrue(default_storage.exists(name))       # still cached, until it's evicted
+        self.assertEqual(self.client.get(link).status_code, 404)
+
+    def test_binary_image_eviction(self):
+        """
+        Least recently used binary images should be deleted above size budget
+        """
+        link = self.get_binary_link(UploadedImage.objects.get(height=200))
+        self.client.get(link)
+        name, _ = get_binary_image(UploadedImage.objects.get(height=200).image.name)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.settings(BINARY_CACHE_MAX_SIZE=0):
+            self.assertGreater(evict_binary_images(force=True), 0)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(self.client.get(link).status_code, 200)      # converted again
+
+    def test_binary_image_eager(self):
+        """
+        Binary images should be converted at upload in tiers with binary images, if BINARY_CACHE_EAGER is on
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        with self.settings(BINARY_CACHE_MAX_SIZE=0):
+            evict_binary_images(force=True)     # files are named by their sources, they could stay from previous uploads
+        img = SimpleUploadedFile("avatar1.png", open(settings.BASE_DIR / "test_images" / "avatar1.png", "rb").read())
+        with self.settings(BINARY_CACHE_EAGER=True), patch("api.binary.render_binary_image", wraps=render_binary_image) as render:
+            self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        original = UploadedImage.objects.get(title="avatar1.png", parent=None)
+        self.assertEqual(render.call_count, 2)     # 200px and 400px (no access to the original)
+        for thumbnail in original.uploadedimage_set.all():
+            name, _ = get_binary_image(thumbnail.image.name)
+            self.assertTrue(default_storage.exists(name))
+
+    def test_binary_image_formats(self):
+        """
+        Binary images should be encoded as 1-bit images in the chosen format
+        """
+        link = self.get_binary_link(UploadedImage.objects.get(height=200))
+        for img_format, content_type in [("png", "image/png"), ("tiff", "image/tiff")]:
+            response = self.client.get(link, {"format": img_format})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], content_type)
+            with Image.open(BytesIO(b"".join(response.streaming_content))) as img:
+                self.assertEqual(img.format, img_format.upper())
+                self.assertEqual(img.mode, "1")
+
+        self.assertEqual(self.client.get(link, {"format": "jpeg"}).status_code, 400)
+
+    def test_binarization_modes(self):
+        """
+        Binarization mode can be chosen with "mode" parameter
+        """
+        link = self.get_binary_link(UploadedImage.objects.get(height=200))
+        contents = set()
+        for mode in BINARIZATION_MODES:
+            response = self.client.get(link, {"mode": mode})
+            self.assertEqual(response.status_code, 200)
+            contents.add(b"".join(response.streaming_content))
+        self.assertEqual(len(contents), len(BINARIZATION_MODES))     # cached separately
+
+        self.assertEqual(self.client.get(link, {"mode": "random"}).status_code, 400)
+
+
+class TestBinarization(TestCase):
+    """
+    Test binarization modes
+    """
+    def setUp(self) -> None:
+        self.gradient = Image.linear_gradient("L").resize((64, 64))     # top to bottom, 0-255
+
+    def test_modes(self):
+        """
+        Every mode should return 1-bit image of the same size
+        """
+        for mode in BINARIZATION_MODES:
+            binary = binarize(self.gradient.convert("RGB"), mode)
+            self.assertEqual(binary.mode, "1")
+            self.assertEqual(binary.size, self.gradient.size)
+
+    def test_threshold(self):
+        """
+        Pixels below threshold should be black, the rest white
+        """
+        with self.settings(BINARIZATION_THRESHOLD=100):
+            binary = binarize(Image.new("L", (2, 1)).point(lambda _: 99), "threshold")
+            self.assertEqual(list(binary.getdata()), [0, 0])
+            binary = binarize(Image.new("L", (2, 1)).point(lambda _: 100), "threshold")
+            self.assertEqual(list(binary.getdata()), [255, 255])
+
+    def test_otsu(self):
+        """
+        Otsu threshold should split bimodal histogram between its peaks
+        """
+        histogram = [0] * 256
+        histogram[40] = histogram[200] = 100
+        self.assertTrue(40 <= get_otsu_threshold(histogram) < 200)
+
+    def test_ordered(self):
+        """
+        Ordered dithering should keep average brightness of the image
+        """
+        for value in (32, 128, 192):
+            binary = binarize(Image.new("L", (64, 64), value), "ordered")
+            white = list(binary.getdata()).count(255) / (64 * 64)
+            self.assertAlmostEqual(white, value / 255, delta=1 / 64)
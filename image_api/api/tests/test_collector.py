@@ -0,0 +1,70 @@
+from django.test import TransactionTestCase
+from django.conf import settings
+from django.core.management import call_command
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight
+from api.collector import collect_orphaned_thumbnails
+from io import StringIO
+from pathlib import Path
+
+
+
+class TestThumbnailCollector(TransactionTestCase):
+    """
+    Test deleting thumbnails unavailable in owners' tiers
+    (transactions are committed - files are deleted after commit)
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile("avatar1.png", open(test_image_dir / "avatar1.png", "rb").read())
+        self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_collect_after_grace_period(self):
+        """
+        Unavailable thumbnail should be deleted only after grace period
+        """
+        thumbnail = UploadedImage.objects.get(height=400)
+        self.delilah.tier = None
+        self.delilah.save()
+
+        self.assertEqual(collect_orphaned_thumbnails(3600, 100), (0, 0))       # still in grace period
+        thumbnail.refresh_from_db()
+        self.assertIsNotNone(thumbnail.orphaned_at)
+
+        deleted, freed = collect_orphaned_thumbnails(0, 100)
+        self.assertEqual(deleted, 1)
+        self.assertGreater(freed, 0)
+        self.assertFalse(UploadedImage.objects.filter(height=400).exists())
+        self.assertFalse(Path(thumbnail.image.path).exists())
+        self.assertTrue(UploadedImage.objects.filter(height=200).exists())      # 200px is always available
+
+    def test_available_again(self):
+        """
+        Thumbnail available again (user returned to previous tier) shouldn't be deleted
+        """
+        self.delilah.tier = None
+        self.delilah.save()
+        collect_orphaned_thumbnails(3600, 100)
+
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        self.assertEqual(collect_orphaned_thumbnails(0, 100), (0, 0))
+        self.assertIsNone(UploadedImage.objects.get(height=400).orphaned_at)
+
+    def test_command(self):
+        """
+        Command should report reclaimed space
+        """
+        self.tier.available_heights.clear()
+        out = StringIO()
+        call_command("collect_thumbnails", "--grace=0", stdout=out)
+        self.assertIn("Deleted 1 thumbnails", out.getvalue())
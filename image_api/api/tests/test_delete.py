@@ -0,0 +1,112 @@
+from django.test import TestCase
+from django.db import transaction
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, StoredFile, Tier, AvailableHeight
+from pathlib import Path
+
+
+
+class TestBulkDelete(TestCase):
+    """
+    Test deleting many images at once and removing their files from storage
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.tier.save()
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.login_data = {"username": "delilah", "password": "1234"}
+        self.test_image_dir = settings.BASE_DIR / "test_images"
+
+        self.client.login(**self.login_data)
+        for image in ["cat1.jpg", "avatar1.png"]:
+            file = SimpleUploadedFile(image, open(self.test_image_dir / image, "rb").read())
+            self.client.post(reverse("images-list"), data={"image": file})
+
+    def get_paths(self, images) -> list[Path]:
+        return [Path(settings.MEDIA_ROOT) / k.image.name for k in images]
+
+    def test_bulk_delete(self):
+        """
+        Images and their thumbnails should be deleted, unknown ids reported
+        """
+        originals = list(UploadedImage.objects.filter(parent=None))
+        paths = self.get_paths(UploadedImage.objects.all())
+        ids = [k.pk for k in originals]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("images-bulk-delete"), data={"ids": ids + [9999]}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"deleted": sorted(ids), "not_found": [9999]})
+
+        self.assertFalse(UploadedImage.objects.exists())
+        self.assertFalse(StoredFile.objects.exists())
+        for path in paths:
+            self.assertFalse(path.exists())
+
+    def test_bulk_delete_other_user(self):
+        """
+        Images of other users can't be deleted
+        """
+        bob = get_user_model().objects.create(username="bob", email="bob@example.com", tier=self.tier)
+        bob.set_password("1234")
+        bob.save()
+        ids = list(UploadedImage.objects.filter(parent=None).values_list("pk", flat=True))
+
+        self.client.login(username="bob", password="1234")
+        response = self.client.post(reverse("images-bulk-delete"), data={"ids": ids}, content_type="application/json")
+        self.assertEqual(response.json(), {"deleted": [], "not_found": sorted(ids)})
+        self.assertEqual(UploadedImage.objects.filter(parent=None).count(), 2)
+
+        response = self.client.post(reverse("images-bulk-delete"), data={"ids": "all"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_destroy(self):
+        """
+        Single image can be deleted with DELETE request
+        """
+        original = UploadedImage.objects.filter(parent=None).first()
+        paths = self.get_paths(UploadedImage.objects.filter(pk=original.pk) | original.uploadedimage_set.all())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse("images-detail", args=(original.pk,)))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(UploadedImage.objects.count(), 3)
+        for path in paths:
+            self.assertFalse(path.exists())
+
+    def test_delete_user(self):
+        """
+        Deleting an account (cascade) shouldn't leave any files behind
+        """
+        paths = self.get_paths(UploadedImage.objects.all())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delilah.delete()
+
+        self.assertFalse(UploadedImage.objects.exists())
+        self.assertFalse(StoredFile.objects.exists())
+        for path in paths:
+            self.assertFalse(path.exists())
+
+    def test_rollback(self):
+        """
+        Files of images restored by rollback should be kept
+        """
+        paths = self.get_paths(UploadedImage.objects.all())
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    UploadedImage.objects.all().delete()
+                    raise ValueError
+            except ValueError:
+                pass
+
+        self.assertEqual(UploadedImage.objects.count(), 6)
+        for path in paths:
+            self.assertTrue(path.exists())
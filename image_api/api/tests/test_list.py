@@ -0,0 +1,297 @@
+from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+
+from api.models import UploadedImage, Tier, AvailableHeight
+from api.pagination import ImageCursorPagination
+from api.cache import get_or_compute, invalidate
+import time
+from rest_framework.test import APIClient
+from api.renderers import FastJSONRenderer
+from api.utils import reverse_path
+from rest_framework.renderers import JSONRenderer
+from decimal import Decimal
+from unittest.mock import patch
+import json
+
+
+class TestListQueries(TestCase):
+    """
+    Test number of queries of the image list
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Enterprise", binary_image=True, original_image=True)
+        self.heights = [300, 400, 500]
+        self.tier.available_heights.add(*[AvailableHeight.objects.create(height=h) for h in self.heights])
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+
+    def add_images(self, count: int) -> None:
+        """
+        Add images with all thumbnails of the tier (rows only, files aren't needed to list them)
+        """
+        originals = UploadedImage.objects.bulk_create([
+            UploadedImage(owner=self.delilah, image=f"images/list{i}.jpg", title=f"list{i}.jpg", height=1000)
+            for i in range(UploadedImage.objects.count(), UploadedImage.objects.count() + count)
+        ])
+        UploadedImage.objects.bulk_create([
+            UploadedImage(owner=self.delilah, parent=original, image=f"{original.image.name}_{h}.jpg", title=original.title, height=h)
+            for original in originals for h in [200, *self.heights]
+        ])
+        invalidate(f"user:{self.delilah.pk}")      # bulk_create doesn't send signals
+
+    def count_list_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("images-list"))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_queries(self):
+        """
+        Number of queries shouldn't depend on the number of images
+        """
+        self.add_images(2)
+        queries = self.count_list_queries()
+        self.add_images(20)
+        self.assertEqual(self.count_list_queries(), queries)
+
+    def test_list_queries_signed(self):
+        """
+        Signed links use timeout of the tier, it shouldn't be queried for every image either
+        """
+        with self.settings(SIGNED_URLS=True):
+            self.add_images(2)
+            queries = self.count_list_queries()
+            self.add_images(20)
+            self.assertEqual(self.count_list_queries(), queries)
+
+    def test_list_representation(self):
+        """
+        All resolutions of the tier should be listed, missing thumbnails as pending
+        """
+        self.add_images(1)
+        UploadedImage.objects.get(height=500).delete()
+
+        data = json.loads(self.client.get(reverse("images-list")).content)
+        resolutions = data["results"][0]["resolutions"]
+        self.assertEqual(set(resolutions), {"200px", "300px", "400px", "500px", "original"})
+        self.assertEqual(resolutions["300px"]["url"], reverse("get_image", args=(UploadedImage.objects.get(height=300).image.name,)))
+        self.assertIn("binary", resolutions["300px"])
+        self.assertEqual(resolutions["500px"], {"status": "pending"})
+
+
+class TestListPagination(TestCase):
+    """
+    Test cursor pagination of the image list
+    """
+    def setUp(self) -> None:
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com")
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+        originals = UploadedImage.objects.bulk_create([
+            UploadedImage(owner=self.delilah, image=f"images/page{i}.jpg", title=f"page{i}.jpg", height=1000) for i in range(25)
+        ])
+        UploadedImage.objects.bulk_create([
+            UploadedImage(owner=self.delilah, parent=original, image=f"{original.image.name}_200.jpg", title=original.title, height=200)
+            for original in originals
+        ])
+
+    def test_pages(self):
+        """
+        Following next links should return all images once, newest first
+        """
+        titles = []
+        url = reverse("images-list") + "?page_size=10"
+        while url:
+            data = json.loads(self.client.get(url).content)
+            self.assertLessEqual(len(data["results"]), 10)
+            titles += [image["title"] for image in data["results"]]
+            url = data["next"]
+        self.assertEqual(titles, [f"page{i}.jpg" for i in reversed(range(25))])
+
+    def test_page_size(self):
+        """
+        Default page size is IMAGE_LIST_PAGE_SIZE, requested one is limited by IMAGE_LIST_MAX_PAGE_SIZE
+        """
+        with patch.object(ImageCursorPagination, "page_size", 7), patch.object(ImageCursorPagination, "max_page_size", 20):
+            self.assertEqual(len(json.loads(self.client.get(reverse("images-list")).content)["results"]), 7)
+            self.assertEqual(len(json.loads(self.client.get(reverse("images-list"), {"page_size": 100}).content)["results"]), 20)
+
+    def test_deep_pages(self):
+        """
+        Deep pages should be fetched by key, the same way as the first one (no OFFSET)
+        """
+        url = reverse("images-list") + "?page_size=5"
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = json.loads(self.client.get(url).content)
+            pages.append(queries)
+            url = data["next"]
+        self.assertEqual(len({len(queries) for queries in pages[:-1]}), 1)
+        for queries in pages:
+            self.assertFalse(any("OFFSET" in query["sql"] for query in queries))
+
+
+class TestResponseCache(TestCase):
+    """
+    Test caching list and retrieve responses
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com")
+        self.original = UploadedImage.objects.create(owner=self.delilah, image="images/cached.jpg", title="cached.jpg", height=1000)
+        UploadedImage.objects.create(owner=self.delilah, parent=self.original, image="images/cached_200.jpg", title="cached.jpg", height=200)
+        UploadedImage.objects.create(owner=self.delilah, parent=self.original, image="images/cached_400.jpg", title="cached.jpg", height=400)
+        self.client = APIClient()
+        self.client.force_authenticate(self.delilah)
+
+    def get_resolutions(self) -> set:
+        return set(json.loads(self.client.get(reverse("images-list")).content)["results"][0]["resolutions"])
+
+    def test_cached(self):
+        """
+        Repeated list and retrieve shouldn't query the database
+        """
+        self.assertEqual(self.get_resolutions(), {"200px"})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_resolutions(), {"200px"})
+
+        detail = reverse("images-detail", args=(self.original.pk,))
+        response = self.client.get(detail)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(detail).content, response.content)
+
+    def test_signed_links_timeout(self):
+        """
+        Responses with signed links should be cached for at most half of tier's signed links timeout
+        """
+        self.tier.signed_url_timeout = 10
+        self.tier.save()
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        with self.settings(SIGNED_URLS=True), patch("api.views.viewsets.get_or_compute", wraps=get_or_compute) as cached:
+            self.get_resolutions()
+            self.assertEqual(cached.call_args.args[3], 5)
+            later = {"monotonic": time.monotonic() + 6, "time": time.time() + 6}       # in process memory and in the shared cache
+            with patch("time.monotonic", return_value=later["monotonic"]), patch("time.time", return_value=later["time"]):
+                with self.assertNumQueries(2):
+                    self.get_resolutions()      # computed again (images and their thumbnails)
+
+    def test_host_not_in_key(self):
+        """
+        Clients shouldn't create new cache entries by changing Host header, nor get links to another host
+        """
+        UploadedImage.objects.create(owner=self.delilah, image="images/cached2.jpg", title="cached2.jpg", height=1000)
+        url = reverse("images-list") + "?page_size=1"
+        with self.settings(ALLOWED_HOSTS=["*"]):
+            self.client.get(url, HTTP_HOST="a.example.com")
+            with self.assertNumQueries(0):
+                data = json.loads(self.client.get(url, HTTP_HOST="b.example.com").content)
+            self.assertTrue(data["next"].startswith(reverse("images-list") + "?"))
+            self.assertNotIn("example.com", json.dumps(data))
+
+    def test_user_tier_change(self):
+        """
+        Changing tier of the user should invalidate the responses
+        """
+        self.assertEqual(self.get_resolutions(), {"200px"})
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        self.assertEqual(self.get_resolutions(), {"200px", "400px"})
+
+    def test_tier_heights_change(self):
+        """
+        Changing heights of the tier should invalidate the responses
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        self.assertEqual(self.get_resolutions(), {"200px", "400px"})
+        self.tier.available_heights.clear()
+        self.assertEqual(self.get_resolutions(), {"200px"})
+
+    def test_image_change(self):
+        """
+        Adding and deleting images should invalidate the responses
+        """
+        self.assertEqual(len(json.loads(self.client.get(reverse("images-list")).content)["results"]), 1)
+        self.original.delete()
+        self.assertEqual(json.loads(self.client.get(reverse("images-list")).content)["results"], [])
+        self.assertEqual(self.client.get(reverse("images-detail", args=(self.original.pk,))).status_code, 404)
+
+
+class TestSparseFields(TestCase):
+    """
+    Test choosing fields and sizes of the image list
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Enterprise", binary_image=True, original_image=True)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        original = UploadedImage.objects.create(owner=self.delilah, image="images/sparse cat.jpg", title="sparse cat.jpg", height=1000)
+        UploadedImage.objects.create(owner=self.delilah, parent=original, image="images/sparse cat_200.jpg", title="sparse cat.jpg", height=200)
+        UploadedImage.objects.create(owner=self.delilah, parent=original, image="images/sparse cat_400.jpg", title="sparse cat.jpg", height=400)
+        self.client = APIClient()
+        self.client.force_authenticate(self.delilah)
+
+    def get_image(self, **params) -> dict:
+        response = self.client.get(reverse("images-list"), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["results"][0]
+
+    def test_all(self):
+        """
+        Without parameters everything is returned
+        """
+        image = self.get_image()
+        self.assertEqual(image["title"], "sparse cat.jpg")
+        self.assertEqual(set(image["resolutions"]), {"200px", "400px", "original"})
+        self.assertEqual(image["resolutions"]["200px"], {
+            "url": reverse("get_image", args=("images/sparse cat_200.jpg",)),
+            "binary": reverse("generate_binary_link", args=("images/sparse cat_200.jpg",)),
+            "status": "ready",
+        })
+
+    def test_fields(self):
+        """
+        Only requested fields should be returned
+        """
+        self.assertEqual(self.get_image(fields="title"), {"title": "sparse cat.jpg"})
+        image = self.get_image(fields="resolutions.url")
+        self.assertEqual(set(image), {"resolutions"})
+        self.assertEqual(image["resolutions"]["200px"], {"url": reverse("get_image", args=("images/sparse cat_200.jpg",))})
+        self.assertEqual(self.client.get(reverse("images-list"), {"fields": "title,size"}).status_code, 400)
+
+    def test_sizes(self):
+        """
+        Only requested sizes should be returned (if they're available)
+        """
+        image = self.get_image(sizes="200px,original,800px")
+        self.assertEqual(set(image["resolutions"]), {"200px", "original"})
+
+
+class TestFastRendering(TestCase):
+    """
+    Test helpers of fast list rendering
+    """
+    def test_reverse_path(self):
+        """
+        URLs built from cached prefixes should be the same as reversed ones
+        """
+        for name in ["images/cat.jpg", "images/a b/ząb #1?.png", "images/100%;x=@~.jpg"]:
+            for viewname in ["get_image", "get_signed_image", "generate_binary_link"]:
+                self.assertEqual(reverse_path(viewname, name), reverse(viewname, args=(name,)))
+
+    def test_renderer(self):
+        """
+        JSON should be the same as rendered by DRF
+        """
+        data = {"title": "ząb\u2028", "resolutions": {"200px": {"status": "pending"}}, "number": Decimal("1.5")}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(FastJSONRenderer().render(data, "application/json; indent=4"), JSONRenderer().render(data, "application/json; indent=4"))
@@ -3,9 +3,12 @@ from django.conf import settings
 from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
 
 from django.conf import settings
-from api.models import UploadedImage, Tier, AvailableHeight
+from api.models import UploadedImage, Tier, TierCapabilities, AvailableHeight
+from api.cache import local_cache
+from django.core.cache import cache
 
 
 
@@ -199,8 +202,132 @@ class TestThumbnails(TestCase):
         for res in [200, 400, 800]:
             thumbnail = UploadedImage.objects.get(height=res)
             response = self.client.get(reverse("get_image", args=(thumbnail.image.name, )))
-            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response.status_code, 404)     # other users' files don't exist for non-owners
 
         original = UploadedImage.objects.get(parent=None)
         response = self.client.get(reverse("get_image", args=(original.image.name, )))
-        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestFileExistence(TestCase):
+    """
+    Test that users can't learn if other users have a file (content-addressed names can be computed from the content)
+    """
+    def setUp(self) -> None:
+        for username in ["delilah", "fake_delilah"]:
+            user = get_user_model().objects.create(username=username, email=f"{username}@example.com")
+            user.set_password("1234")
+            user.save()
+        self.client.login(username="delilah", password="1234")
+        img = SimpleUploadedFile("cat1.jpg", open(settings.BASE_DIR / "test_images" / "cat1.jpg", "rb").read())
+        self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_other_users_cas_path(self):
+        """
+        Other user's file should look exactly like a file that doesn't exist
+        """
+        thumbnail = UploadedImage.objects.get(height=200)
+        self.assertTrue(thumbnail.image.name.startswith("cas/"))
+        missing = thumbnail.image.name.replace(thumbnail.image.name.split("/")[2][:16], "0" * 16)
+
+        self.client.login(username="fake_delilah", password="1234")
+        existing = self.client.get(reverse("get_image", args=(thumbnail.image.name, )))
+        not_existing = self.client.get(reverse("get_image", args=(missing, )))
+        self.assertEqual(existing.status_code, 404)
+        self.assertEqual(not_existing.status_code, 404)
+        self.assertEqual(existing.content, not_existing.content)
+
+
+class TestAccessCache(TestCase):
+    """
+    Test caching decisions if user can see an image
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile("cat1.jpg", open(test_image_dir / "cat1.jpg", "rb").read())
+        self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_no_queries(self):
+        """
+        Serving a file again shouldn't query the database (besides authentication)
+        """
+        client = APIClient()
+        client.force_authenticate(self.delilah)
+        thumbnail = UploadedImage.objects.get(height=400)
+        self.assertEqual(client.get(reverse("get_image", args=(thumbnail.image.name, ))).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(reverse("get_image", args=(thumbnail.image.name, ))).status_code, 200)
+
+        original = UploadedImage.objects.get(parent=None)
+        self.assertEqual(client.get(reverse("get_image", args=(original.image.name, ))).status_code, 403)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(reverse("get_image", args=(original.image.name, ))).status_code, 403)
+
+    def test_invalidation(self):
+        """
+        Cached decisions should change with user's tier, tier's heights and user's images
+        """
+        original = UploadedImage.objects.get(parent=None)
+        thumbnail = UploadedImage.objects.get(height=400)
+        self.assertEqual(self.client.get(reverse("get_image", args=(original.image.name, ))).status_code, 403)
+        self.assertEqual(self.client.get(reverse("get_image", args=(thumbnail.image.name, ))).status_code, 200)
+
+        self.tier.available_heights.clear()
+        self.assertEqual(self.client.get(reverse("get_image", args=(thumbnail.image.name, ))).status_code, 403)
+
+        self.delilah.tier = Tier.objects.create(name="Enterprise", original_image=True)
+        self.delilah.save()
+        self.assertEqual(self.client.get(reverse("get_image", args=(original.image.name, ))).status_code, 200)
+
+        original.delete()
+        self.assertEqual(self.client.get(reverse("get_image", args=(original.image.name, ))).status_code, 404)
+
+
+class TestTierCapabilities(TestCase):
+    """
+    Test caching capabilities of tiers
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", binary_image=True)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+
+    def test_cached(self):
+        """
+        Capabilities should be read from the database once
+        """
+        capabilities = Tier.get_capabilities(self.tier.pk)
+        self.assertEqual(capabilities, TierCapabilities(binary_image=True, extra_image_sizes=(400,)))
+        with self.assertNumQueries(0):
+            self.assertEqual(Tier.get_capabilities(self.tier.pk), capabilities)
+            self.assertEqual(Tier.get_capabilities(None), TierCapabilities())      # basic tier
+
+    def test_invalidation(self):
+        """
+        Changes of the tier and its heights should be visible at once
+        """
+        Tier.get_capabilities(self.tier.pk)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=600))
+        self.assertEqual(set(Tier.get_capabilities(self.tier.pk).extra_image_sizes), {400, 600})
+        self.tier.original_image = True
+        self.tier.save()
+        self.assertTrue(Tier.get_capabilities(self.tier.pk).original_image)
+        self.tier.delete()
+        self.assertEqual(Tier.get_capabilities(self.tier.pk), TierCapabilities())
+
+    def test_other_process(self):
+        """
+        Changes made by other processes should be visible after the local cache expires
+        """
+        Tier.get_capabilities(self.tier.pk)
+        Tier.objects.filter(pk=self.tier.pk).update(binary_image=False)     # no signals, like in other process...
+        cache.incr("generation:tiers")                                      # ...which bumps the shared generation only
+        self.assertTrue(Tier.get_capabilities(self.tier.pk).binary_image)  # still remembered in this process
+        local_cache.clear()     # LOCAL_CACHE_TIMEOUT passed
+        self.assertFalse(Tier.get_capabilities(self.tier.pk).binary_image)
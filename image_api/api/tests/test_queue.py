@@ -0,0 +1,210 @@
+from django.test import TestCase, override_settings
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight, RenditionJob, BackfillJob
+from api.jobs import process_next_rendition_job, process_next_backfill_job
+from unittest.mock import patch
+import json
+
+
+
+@override_settings(RENDITION_QUEUE=True)
+class TestRenditionQueue(TestCase):
+    """
+    Test rendering thumbnails in background workers
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.tier.save()
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.login_data = {"username": "delilah", "password": "1234"}
+
+    def upload(self, image="cat1.jpg"):
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+        return self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_upload_enqueues_thumbnails(self):
+        """
+        Upload should return before thumbnails are rendered
+        """
+        self.client.login(**self.login_data)
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+
+        resolutions = json.loads(response.content)["resolutions"]
+        self.assertEqual(resolutions["200px"], {"status": "pending"})
+        self.assertEqual(resolutions["400px"], {"status": "pending"})
+        self.assertEqual(RenditionJob.objects.count(), 2)
+        self.assertFalse(UploadedImage.objects.exclude(parent=None).filter(status=UploadedImage.Status.READY).exists())
+
+    def test_worker_renders_thumbnails(self):
+        """
+        Worker should render 200px thumbnails first, then other sizes
+        """
+        self.client.login(**self.login_data)
+        self.upload()
+
+        self.assertTrue(process_next_rendition_job())
+        self.assertEqual(UploadedImage.objects.get(height=200).status, UploadedImage.Status.READY)
+        self.assertEqual(UploadedImage.objects.get(height=400).status, UploadedImage.Status.PENDING)
+
+        self.assertTrue(process_next_rendition_job())
+        self.assertFalse(process_next_rendition_job())      # queue is empty
+        thumbnail = UploadedImage.objects.get(height=400)
+        self.assertEqual(thumbnail.status, UploadedImage.Status.READY)
+        self.assertEqual(thumbnail.image.height, 400)       # file is rendered
+
+        original = UploadedImage.objects.get(parent=None)
+        response = self.client.get(reverse("images-detail", args=(original.pk,)))
+        self.assertEqual(json.loads(response.content)["resolutions"]["400px"]["status"], "ready")
+
+    def test_fair_queue(self):
+        """
+        Jobs of a user uploading later shouldn't wait for all jobs of a heavy uploader
+        """
+        self.client.login(**self.login_data)
+        for _ in range(3):
+            self.upload()
+
+        other = get_user_model().objects.create(username="fake_delilah", email="fake_delilah@example.com")
+        other.set_password("1234")
+        other.save()
+        self.client.login(username="fake_delilah", password="1234")
+        self.upload()
+
+        process_next_rendition_job()
+        process_next_rendition_job()
+        ready = UploadedImage.objects.filter(status=UploadedImage.Status.READY).exclude(parent=None)
+        self.assertCountEqual([self.delilah, other], [k.owner for k in ready])
+
+
+@override_settings(RENDITION_QUEUE=True, BACKFILL_CHUNK_SIZE=2)
+class TestBackfill(TestCase):
+    """
+    Test creating thumbnails of existing images in background, after tier change
+    """
+    def setUp(self) -> None:
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com")
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+        test_image_dir = settings.BASE_DIR / "test_images"
+        for image in ["cat1.jpg", "avatar1.png", "cat1.jpg"]:
+            img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+            self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        while process_next_rendition_job():
+            pass
+
+        self.tier = Tier.objects.create(name="Premium")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=800))
+
+    def test_tier_change_backfill(self):
+        """
+        Tier change should only start a job, which creates thumbnails chunk by chunk
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        self.assertFalse(UploadedImage.objects.filter(height__in=[400, 800]).exists())     # nothing done in the request
+
+        job = BackfillJob.objects.get()
+        self.assertEqual((job.processed, job.total, job.heights), (0, 3, [400, 800]))
+
+        self.assertTrue(process_next_backfill_job())
+        job.refresh_from_db()
+        self.assertEqual(job.processed, 2)
+        self.assertEqual(UploadedImage.objects.filter(height__in=[400, 800]).count(), 4)
+
+        while process_next_backfill_job():
+            pass
+        job.refresh_from_db()
+        self.assertEqual(job.processed, 3)
+        self.assertIsNotNone(job.finished_at)
+
+        while process_next_rendition_job():
+            pass
+        for original in UploadedImage.objects.filter(parent=None):
+            self.assertCountEqual([200, 400, 800], [k.height for k in original.uploadedimage_set.filter(status=UploadedImage.Status.READY)])
+
+    def test_backfill_restart(self):
+        """
+        Job restarted from the beginning shouldn't create any thumbnail twice
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        job = BackfillJob.objects.get()
+        process_next_backfill_job()
+
+        job.refresh_from_db()
+        job.cursor = 0      # simulate lost progress
+        job.save()
+        while process_next_backfill_job():
+            pass
+
+        for original in UploadedImage.objects.filter(parent=None):
+            self.assertCountEqual([200, 400, 800], [k.height for k in original.uploadedimage_set.all()])
+
+    def test_tier_extend_backfill(self):
+        """
+        Adding height to a tier should create thumbnails of all images of users in the tier, in background
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        while process_next_backfill_job() or process_next_rendition_job():
+            pass
+
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=600))
+        self.assertFalse(UploadedImage.objects.filter(height=600).exists())     # nothing done in the request
+        job = BackfillJob.objects.get(tier=self.tier)
+        self.assertEqual((job.heights, job.total), ([600], 3))
+
+        while process_next_backfill_job() or process_next_rendition_job():
+            pass
+        job.refresh_from_db()
+        self.assertEqual(job.progress, "100%")
+        self.assertEqual(UploadedImage.objects.filter(height=600, status=UploadedImage.Status.READY).count(), 3)
+
+    def test_backfill_failure(self):
+        """
+        Failed chunk should be rolled back and retried, job is abandoned after BACKFILL_JOB_MAX_ATTEMPTS
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        job = BackfillJob.objects.get()
+        run_chunk = BackfillJob.run_chunk
+
+        def failing_chunk(job):
+            run_chunk(job)      # changes are rolled back
+            raise RuntimeError("broken chunk")
+
+        with patch.object(BackfillJob, "run_chunk", failing_chunk):
+            for _ in range(settings.BACKFILL_JOB_MAX_ATTEMPTS):
+                self.assertTrue(process_next_backfill_job())
+            self.assertFalse(process_next_backfill_job())      # abandoned
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.processed, job.cursor), (settings.BACKFILL_JOB_MAX_ATTEMPTS, 0, 0))
+        self.assertIn("broken chunk", job.last_error)
+        self.assertFalse(UploadedImage.objects.filter(height__in=[400, 800]).exists())
+
+    def test_backfill_retry(self):
+        """
+        Chunk that fails less than BACKFILL_JOB_MAX_ATTEMPTS times should be done, attempts are counted per chunk
+        """
+        self.delilah.tier = self.tier
+        self.delilah.save()
+        job = BackfillJob.objects.get()
+        with patch.object(BackfillJob, "run_chunk", side_effect=RuntimeError("temporary error")):
+            process_next_backfill_job()
+        while process_next_backfill_job():
+            pass
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(UploadedImage.objects.filter(height__in=[400, 800]).count(), 6)
@@ -0,0 +1,67 @@
+from django.test import TestCase
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight
+
+
+
+class TestServing(TestCase):
+    """
+    Test HTTP headers of served images and conditional requests
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", original_image=True)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=100))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile("avatar1.png", open(test_image_dir / "avatar1.png", "rb").read())
+        self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_headers(self):
+        """
+        Images should have their real content type and caching headers
+        """
+        for image in UploadedImage.objects.all():
+            response = self.client.get(reverse("get_image", args=(image.image.name, )))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "image/png")
+            self.assertEqual(response["ETag"], image.etag)
+            self.assertIn("Last-Modified", response)
+            self.assertIn("immutable", response["Cache-Control"])
+            self.assertIn("private", response["Cache-Control"])
+
+    def test_not_modified(self):
+        """
+        Repeated requests should be answered with 304
+        """
+        thumbnail = UploadedImage.objects.get(height=100)
+        url = reverse("get_image", args=(thumbnail.image.name, ))
+        response = self.client.get(url)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertFalse(not_modified.content)
+
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        other = UploadedImage.objects.get(height=200)
+        response = self.client.get(reverse("get_image", args=(other.image.name, )), HTTP_IF_NONE_MATCH=thumbnail.etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_other_user(self):
+        """
+        Users without access shouldn't get 304 either
+        """
+        original = UploadedImage.objects.get(parent=None)
+        self.delilah.tier = None
+        self.delilah.save()
+        response = self.client.get(reverse("get_image", args=(original.image.name, )), HTTP_IF_NONE_MATCH=original.etag)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,78 @@
+from django.test import TestCase, override_settings
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight
+from api.signing import get_signature
+from urllib.parse import parse_qs, urlsplit
+import time
+
+
+
+@override_settings(SIGNED_URLS=True, SIGNED_URL_KEYS={"1": "old secret", "2": "new secret"}, SIGNED_URL_KEY_ID="2")
+class TestSignedUrls(TestCase):
+    """
+    Test links to images signed for nginx (verified by the API when there's no nginx)
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", original_image=True, signed_url_timeout=7200)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile("cat1.jpg", open(test_image_dir / "cat1.jpg", "rb").read())
+        self.resolutions = self.client.post(reverse("images-list"), data={"image": img}, follow=True).json()["resolutions"]
+
+    def test_signed_links(self):
+        """
+        Signed links should work without logging in, for as long as user's tier says
+        """
+        self.client.logout()
+        for resolution in ["200px", "400px", "original"]:
+            url = self.resolutions[resolution]["url"]
+            self.assertTrue(url.startswith("/signed/"))
+            query = parse_qs(urlsplit(url).query)
+            self.assertEqual(query["k"], ["2"])
+            self.assertGreaterEqual(int(query["expires"][0]), time.time() + 7200)
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_wrong_links(self):
+        """
+        Links with wrong signature, unknown key or expired shouldn't work
+        """
+        self.client.logout()
+        path = reverse("get_signed_image", args=(UploadedImage.objects.get(parent=None).image.name,))
+        expires = int(time.time()) + 60
+
+        response = self.client.get(path, {"md5": get_signature(path, expires, "old secret"), "expires": expires, "k": "1"})
+        self.assertEqual(response.status_code, 200)     # links signed with previous key still work
+        response = self.client.get(path, {"md5": get_signature(path, expires, "old secret"), "expires": expires, "k": "2"})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(path, {"md5": get_signature(path, expires, "new secret"), "expires": expires, "k": "3"})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(path, {"md5": get_signature(path, expires, "new secret"), "expires": expires + 1, "k": "2"})
+        self.assertEqual(response.status_code, 403)
+
+        other = reverse("get_signed_image", args=(UploadedImage.objects.get(height=400).image.name,))
+        response = self.client.get(other, {"md5": get_signature(path, expires, "new secret"), "expires": expires, "k": "2"})
+        self.assertEqual(response.status_code, 403)     # signature of a different file
+
+        expired = int(time.time()) - 60
+        response = self.client.get(path, {"md5": get_signature(path, expired, "new secret"), "expires": expired, "k": "2"})
+        self.assertEqual(response.status_code, 410)
+
+    def test_lazy_thumbnails(self):
+        """
+        Files of lazy thumbnails don't exist yet, their links go to the API
+        """
+        self.tier.lazy_thumbnails = True
+        self.tier.save()
+        img = SimpleUploadedFile("avatar1.png", open(settings.BASE_DIR / "test_images" / "avatar1.png", "rb").read())
+        resolutions = self.client.post(reverse("images-list"), data={"image": img}, follow=True).json()["resolutions"]
+        self.assertTrue(resolutions["200px"]["url"].startswith("/signed/"))
+        self.assertTrue(resolutions["400px"]["url"].startswith("/images/"))
@@ -0,0 +1,108 @@
+from django.test import TestCase
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, Tier, AvailableHeight, StoredFile
+from pathlib import Path
+from unittest.mock import patch
+import api.reaper
+
+
+
+class TestContentAddressedStorage(TestCase):
+    """
+    Test deduplication of uploaded files and thumbnails
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", original_image=True)
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400))
+        self.tier.save()
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.other = get_user_model().objects.create(username="fake_delilah", email="fake_delilah@example.com", tier=self.tier)
+        self.other.set_password("1234")
+        self.other.save()
+
+    def upload(self, username, image="cat1.jpg"):
+        self.client.login(username=username, password="1234")
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+        response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_duplicate_upload(self):
+        """
+        The same file uploaded twice should be stored (and resized) only once
+        """
+        self.upload("delilah")
+        self.upload("fake_delilah")
+
+        self.assertEqual(UploadedImage.objects.count(), 6)      # 2 originals, 2x 200px, 2x 400px
+        self.assertEqual(StoredFile.objects.count(), 3)         # original, 200px, 400px
+        for stored in StoredFile.objects.all():
+            self.assertEqual(stored.references, 2)
+            self.assertEqual(UploadedImage.objects.filter(image=stored.name).count(), 2)
+
+    def test_shared_file_permissions(self):
+        """
+        Both owners of the same file should have access to it
+        """
+        self.upload("delilah")
+        self.upload("fake_delilah")
+
+        for image in UploadedImage.objects.all():
+            response = self.client.get(reverse("get_image", args=(image.image.name,)))
+            self.assertEqual(response.status_code, 200)
+
+    def test_delete_shared_file(self):
+        """
+        File should be deleted only with the last image using it
+        """
+        self.upload("delilah")
+        self.upload("fake_delilah")
+        names = list(StoredFile.objects.values_list("name", flat=True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedImage.objects.get(parent=None, owner=self.delilah).delete()
+        for name in names:
+            self.assertTrue((Path(settings.MEDIA_ROOT) / name).exists())
+        self.assertEqual(set(StoredFile.objects.values_list("references", flat=True)), {1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedImage.objects.get(parent=None, owner=self.other).delete()
+        for name in names:
+            self.assertFalse((Path(settings.MEDIA_ROOT) / name).exists())
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_release(self):
+        """
+        Only files without references left (or not stored in content-addressed storage) should be returned for deletion
+        """
+        StoredFile.objects.create(key="a", name="cas/aa/a.jpg", references=2)
+        StoredFile.objects.create(key="b", name="cas/bb/b.jpg", references=3)
+        unused = StoredFile.release(["cas/aa/a.jpg", "cas/aa/a.jpg", "cas/bb/b.jpg", "images/old.jpg"])
+        self.assertEqual(sorted(unused), ["cas/aa/a.jpg", "images/old.jpg"])
+        self.assertEqual(list(StoredFile.objects.values_list("name", "references")), [("cas/bb/b.jpg", 2)])
+
+    def test_render_while_deleting(self):
+        """
+        File rendered again for the same key before the released one is deleted from storage shouldn't be deleted with it
+        """
+        self.upload("delilah")
+        delete_files = api.reaper.delete_files
+
+        def upload_before_delete(paths):
+            self.upload("fake_delilah")
+            return delete_files(paths)
+
+        with patch("api.reaper.delete_files", side_effect=upload_before_delete), self.captureOnCommitCallbacks(execute=True):
+            UploadedImage.objects.get(parent=None, owner=self.delilah).delete()
+        images = UploadedImage.objects.filter(owner=self.other)
+        self.assertEqual(images.count(), 3)
+        for image in images:
+            self.assertEqual(image.status, UploadedImage.Status.READY)
+            self.assertTrue((Path(settings.MEDIA_ROOT) / image.image.name).exists())
@@ -7,6 +7,11 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 
 from django.conf import settings
 from api.models import UploadedImage, Tier, AvailableHeight
+from api.utils import draft_image
+from api.reencoder import reencode_thumbnails
+from pathlib import Path
+from PIL import Image
+from io import BytesIO
 
 
 
@@ -86,3 +91,169 @@ class TestThumbnails(TestCase):
         images = UploadedImage.objects.all()
         self.assertEqual(images.count(), 4)                 # original, 200px, 400px, 800px
         self.assertCountEqual([200, 400, 800], [k.height for k in images.exclude(parent=None)])  # 800px added
+
+
+    def test_thumbnail_creation_multiple_sizes(self):
+        """
+        All thumbnails should be created from one decode, with proper heights and aspect ratio
+        """
+        for height in [300, 600, 1000]:
+            self.tier.available_heights.add(AvailableHeight.objects.create(height=height))
+
+        self.client.login(**self.login_data)
+        test_image_dir = settings.BASE_DIR / "test_images"
+        image = "cat1.jpg"
+        img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+        data = {"image": img}
+        response = self.client.post(reverse("images-list"), data=data, follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        original = UploadedImage.objects.get(parent=None)
+        thumbnails = original.uploadedimage_set.all()
+        self.assertCountEqual([200, 300, 400, 600, 1000], [k.height for k in thumbnails])
+        aspect_ratio = original.image.width / original.image.height
+        for thumbnail in thumbnails:
+            self.assertEqual(thumbnail.image.height, thumbnail.height)                      # files are really resized
+            self.assertEqual(thumbnail.image.width, int(thumbnail.height * aspect_ratio))   # aspect ratio is saved
+
+
+    def test_thumbnail_creation_executors(self):
+        """
+        Thumbnails should be the same no matter how they are rendered
+        """
+        for height in [300, 600]:
+            self.tier.available_heights.add(AvailableHeight.objects.create(height=height))
+
+        self.client.login(**self.login_data)
+        test_image_dir = settings.BASE_DIR / "test_images"
+        image = "cat1.jpg"
+        for executor in ["serial", "thread", "process"]:
+            with self.settings(RENDITION_EXECUTOR=executor):
+                img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+                response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+                self.assertEqual(response.status_code, 200)
+
+        for original in UploadedImage.objects.filter(parent=None):
+            thumbnails = original.uploadedimage_set.all()
+            self.assertCountEqual([200, 300, 400, 600], [k.height for k in thumbnails])
+            for thumbnail in thumbnails:
+                self.assertEqual(thumbnail.image.height, thumbnail.height)
+
+
+    def test_thumbnail_creation_large_jpeg(self):
+        """
+        Big JPEGs are decoded already scaled down, thumbnails should still have exact sizes
+        """
+        buffer = BytesIO()
+        Image.new("RGB", (3000, 2400), "orange").save(buffer, format="JPEG")
+
+        with Image.open(BytesIO(buffer.getvalue())) as img:
+            draft_image(img, 200, img.width/img.height)
+            self.assertEqual(img.size, (375, 300))      # decoded in 1/8 scale
+
+        self.client.login(**self.login_data)
+        img = SimpleUploadedFile("big.jpg", buffer.getvalue())
+        response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        for thumbnail in UploadedImage.objects.exclude(parent=None):
+            self.assertEqual(thumbnail.image.height, thumbnail.height)
+            self.assertEqual(thumbnail.image.width, int(thumbnail.height * 3000 / 2400))
+
+
+    def test_thumbnail_creation_lazy(self):
+        """
+        In lazy tiers extra thumbnails should be rendered on the first download
+        """
+        self.tier.lazy_thumbnails = True
+        self.tier.save()
+
+        self.client.login(**self.login_data)
+        test_image_dir = settings.BASE_DIR / "test_images"
+        image = "cat1.jpg"
+        img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+        response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        resolutions = response.json()["resolutions"]
+        self.assertEqual(resolutions["400px"]["status"], "ready")      # available to download
+
+        self.assertEqual(UploadedImage.objects.get(height=200).status, UploadedImage.Status.READY)
+        thumbnail = UploadedImage.objects.get(height=400)
+        self.assertEqual(thumbnail.status, UploadedImage.Status.LAZY)
+
+        response = self.client.get(resolutions["400px"]["url"])
+        self.assertEqual(response.status_code, 200)
+        thumbnail.refresh_from_db()
+        self.assertEqual(thumbnail.status, UploadedImage.Status.READY)
+        self.assertEqual(thumbnail.image.height, 400)
+
+        modified = thumbnail.image.storage.get_modified_time(thumbnail.image.name)
+        response = self.client.get(resolutions["400px"]["url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(modified, thumbnail.image.storage.get_modified_time(thumbnail.image.name))     # rendered only once
+
+
+class TestEncoderProfiles(TestCase):
+    """
+    Test encoding thumbnails with profiles of tiers and heights, and re-encoding them
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", encoder_profile="small")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=400, encoder_profile="fast"))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+
+    def upload(self) -> None:
+        img = SimpleUploadedFile("cat1.jpg", open(settings.BASE_DIR / "test_images" / "cat1.jpg", "rb").read())
+        self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+    def test_profiles(self):
+        """
+        Thumbnails should be encoded with profile of their height or tier
+        """
+        self.upload()
+        thumbnail = UploadedImage.objects.get(height=200)
+        self.assertEqual(thumbnail.profile, "small")
+        with Image.open(thumbnail.image.path) as img:
+            self.assertTrue(img.info.get("progressive"))
+            self.assertNotIn("exif", img.info)
+            self.assertNotIn("icc_profile", img.info)
+        self.assertEqual(UploadedImage.objects.get(height=400).profile, "fast")
+
+    def test_reencode(self):
+        """
+        Thumbnails rendered with upload profile should be re-encoded with their target profile in the background
+        """
+        with self.settings(UPLOAD_ENCODER_PROFILE="fast"):
+            self.upload()
+        thumbnail = UploadedImage.objects.get(height=200)
+        self.assertEqual(thumbnail.profile, "fast")
+        old_path = Path(thumbnail.image.path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reencode_thumbnails(10), 1)      # 400px is already encoded with its target profile
+        thumbnail.refresh_from_db()
+        self.assertEqual(thumbnail.profile, "small")
+        self.assertFalse(old_path.exists())
+        with Image.open(thumbnail.image.path) as img:
+            self.assertTrue(img.info.get("progressive"))
+            self.assertEqual(img.height, 200)
+
+        response = self.client.get(reverse("get_image", args=(thumbnail.image.name, )))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reencode_thumbnails(10), 0)
+
+    def test_long_profile_name(self):
+        """
+        Names of files encoded with profiles with the longest names should fit in the image field
+        """
+        profile = "p" * UploadedImage._meta.get_field("profile").max_length
+        with self.settings(ENCODER_PROFILES={**settings.ENCODER_PROFILES, profile: settings.ENCODER_PROFILES["small"]}):
+            self.tier.encoder_profile = profile
+            self.tier.save()
+            self.upload()
+        for image in UploadedImage.objects.all():
+            self.assertLessEqual(len(image.image.name), UploadedImage._meta.get_field("image").max_length)
+        self.assertEqual(UploadedImage.objects.get(height=200).profile, profile)
@@ -6,6 +6,12 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 
 from django.conf import settings
 from api.models import UploadedImage
+from api.uploads import UPLOAD_TEMP_DIR
+from unittest.mock import patch
+from io import BytesIO
+from PIL import Image
+import zipfile
+import json
 
 
 
@@ -107,4 +113,59 @@ class TestUpload(TestCase):
         data = {"image": img}
         response = self.client.post(reverse("images-list"), data=data, follow=True)
         self.assertEqual(response.status_code, 400)                             # 400 = validation error
-        self.assertFalse(UploadedImage.objects.filter(title=image).count())     # entry wasnt created
\ No newline at end of file
+        self.assertFalse(UploadedImage.objects.filter(title=image).count())     # entry wasnt created
+
+    def test_upload_streamed_to_disk(self):
+        """
+        Uploaded file should be moved to its final location, without leftovers
+        """
+        self.client.login(**self.login_data)
+        test_image_dir = settings.BASE_DIR / "test_images"
+        for image in ["cat1.jpg", "kiwka.gif"]:
+            img = SimpleUploadedFile(image, open(test_image_dir / image, "rb").read())
+            self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+
+        original = UploadedImage.objects.get(parent=None)
+        self.assertEqual(open(original.image.path, "rb").read(), open(test_image_dir / "cat1.jpg", "rb").read())
+        self.assertEqual(list((settings.MEDIA_ROOT / UPLOAD_TEMP_DIR).iterdir()), [])      # no temporary files left
+
+    def test_error_message(self):
+        """
+        Rejected file should be reported with the reason
+        """
+        self.client.login(**self.login_data)
+        img = SimpleUploadedFile("notes.jpg", b"just some text, not an image")
+        response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"image": ["Wrong image file! Probably not an image!"]})
+
+        test_image_dir = settings.BASE_DIR / "test_images"
+        img = SimpleUploadedFile("kiwka.jpg", open(test_image_dir / "kiwka.gif", "rb").read())
+        response = self.client.post(reverse("images-list"), data={"image": img}, follow=True)
+        self.assertEqual(response.json(), {"image": ["Unsupported image format! Must be JPEG or PNG, currently GIF."]})
+
+    def test_decompression_bomb(self):
+        """
+        Images over twice MAX_IMAGE_PIXELS (PIL refuses to open them) should be rejected, alone and in archives
+        """
+        self.client.login(**self.login_data)
+        content = BytesIO()
+        Image.new("RGB", (300, 300)).save(content, format="PNG")
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("bomb.png", content.getvalue())
+            small = BytesIO()
+            Image.new("RGB", (8, 8)).save(small, format="PNG")
+            zf.writestr("small.png", small.getvalue())
+
+        with patch.object(Image, "MAX_IMAGE_PIXELS", 100):
+            response = self.client.post(reverse("images-list"), data={"image": SimpleUploadedFile("bomb.png", content.getvalue())}, follow=True)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {"image": ["Image is too big!"]})
+
+            response = self.client.post(reverse("images-batch"), data={"archive": SimpleUploadedFile("images.zip", archive.getvalue())}, follow=True)
+            self.assertEqual(response.status_code, 200)
+            results = {r["name"]: r for r in json.loads(response.content)["results"]}
+            self.assertEqual(results["bomb.png"]["error"], "Image is too big!")
+            self.assertEqual(results["small.png"]["status"], "created")     # the rest of the batch isn't affected
+        self.assertFalse(UploadedImage.objects.filter(title="bomb.png").exists())
@@ -0,0 +1,82 @@
+from django.test import TestCase
+from django.conf import settings
+from rest_framework.reverse import reverse
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from api.models import UploadedImage, ImageVariant, Tier, AvailableHeight
+from PIL import Image
+from io import BytesIO
+from pathlib import Path
+
+
+
+class TestVariants(TestCase):
+    """
+    Test serving thumbnails in formats accepted by the client
+    """
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name="Premium", variant_formats="WEBP")
+        self.tier.available_heights.add(AvailableHeight.objects.create(height=100))
+        self.delilah = get_user_model().objects.create(username="delilah", email="delilah@example.com", tier=self.tier)
+        self.delilah.set_password("1234")
+        self.delilah.save()
+        self.client.login(username="delilah", password="1234")
+        self.test_image_dir = settings.BASE_DIR / "test_images"
+
+    def upload(self) -> dict:
+        img = SimpleUploadedFile("avatar1.png", open(self.test_image_dir / "avatar1.png", "rb").read())
+        return self.client.post(reverse("images-list"), data={"image": img}, follow=True).json()
+
+    def test_lazy_variant(self):
+        """
+        Variant should be rendered on the first download accepting it, under the same URL
+        """
+        url = self.upload()["resolutions"]["100px"]["url"]
+        self.assertFalse(ImageVariant.objects.exists())
+
+        response = self.client.get(url, HTTP_ACCEPT="image/avif,image/webp,*/*")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("Accept", response["Vary"])
+        with Image.open(BytesIO(b"".join(response.streaming_content))) as img:
+            self.assertEqual(img.format, "WEBP")
+            self.assertEqual(img.height, 100)
+        webp_etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_ACCEPT="image/webp")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=webp_etag, HTTP_ACCEPT="image/webp").status_code, 304)
+
+        response = self.client.get(url, HTTP_ACCEPT="image/png,*/*")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertNotEqual(response["ETag"], webp_etag)
+        self.assertEqual(ImageVariant.objects.count(), 1)
+
+    def test_eager_variants(self):
+        """
+        Variants should be rendered with thumbnails if tier says so, files are deleted with the image
+        """
+        self.tier.lazy_variants = False
+        self.tier.save()
+        self.upload()
+        self.assertCountEqual([200, 100], [v.thumbnail.height for v in ImageVariant.objects.all()])
+        paths = [Path(v.image.path) for v in ImageVariant.objects.all()]
+        for path in paths:
+            self.assertTrue(path.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedImage.objects.get(parent=None).delete()
+        self.assertFalse(ImageVariant.objects.exists())
+        for path in paths:
+            self.assertFalse(path.exists())
+
+    def test_basic_tier(self):
+        """
+        Users without variant formats in their tier get thumbnails in the original format
+        """
+        self.tier.variant_formats = ""
+        self.tier.save()
+        url = self.upload()["resolutions"]["200px"]["url"]
+        response = self.client.get(url, HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(response["Content-Type"], "image/png")
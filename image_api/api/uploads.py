@@ -0,0 +1,149 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from PIL import Image
+
+
+
+ALLOWED_FORMATS = {
+    "JPEG": b"\xff\xd8\xff",
+    "PNG": b"\x89PNG\r\n\x1a\n",
+}
+UPLOAD_TEMP_DIR = ".uploads"        # inside MEDIA_ROOT, so saving uploaded file is only a rename
+
+
+class ImageRejected(Exception):
+    pass
+
+
+def read_image_header(header: bytes) -> tuple[str, tuple[int, int]] | None:
+    """
+    Returns format and size of an image, based only on the beginning of the file,
+    None if more data is needed, raises ImageRejected if file is not a JPEG or PNG image
+    """
+    if not any(header.startswith(magic[:len(header)]) for magic in ALLOWED_FORMATS.values()):
+        try:
+            with Image.open(BytesIO(header)) as img:
+                raise ImageRejected(f"Unsupported image format! Must be JPEG or PNG, currently {img.format}.")
+        except Image.DecompressionBombError:    # not an OSError, PIL raises it for images over 2x MAX_IMAGE_PIXELS
+            raise ImageRejected("Image is too big!")
+        except (OSError, SyntaxError, ValueError):
+            raise ImageRejected("Wrong image file! Probably not an image!")
+
+    try:
+        with Image.open(BytesIO(header)) as img:     # reads headers only, image data isn't decoded
+            if img.format not in ALLOWED_FORMATS:
+                raise ImageRejected(f"Unsupported image format! Must be JPEG or PNG, currently {img.format}.")
+            if img.width * img.height > Image.MAX_IMAGE_PIXELS:
+                raise ImageRejected("Image is too big!")
+            return img.format, img.size
+    except Image.DecompressionBombError:
+        raise ImageRejected("Image is too big!")
+    except (OSError, SyntaxError, ValueError):
+        # header is incomplete yet
+        if len(header) >= settings.UPLOAD_HEADER_MAX_SIZE:
+            raise ImageRejected("Problem with loading image!")
+        return None
+
+
+class StreamedImageFile(TemporaryUploadedFile):
+    """
+    Uploaded image written to a temporary file inside MEDIA_ROOT,
+    with format and size read from its header
+    """
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = Path(settings.MEDIA_ROOT) / UPLOAD_TEMP_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.image_format = None
+        self.image_size = None
+        self.content_hash = None
+
+
+def stream_image(name: str, chunks) -> StreamedImageFile:
+    """
+    Write image given in chunks to a temporary file, the same way ImageUploadHandler does
+    (header is checked first, content is hashed). Raises ImageRejected for wrong files
+    """
+    file = StreamedImageFile(name, None, 0, None)
+    header = b""
+    content_hash = hashlib.sha256()
+    try:
+        for chunk in chunks:
+            if file.image_format is None:
+                header += chunk
+                image_info = read_image_header(header)
+                if image_info:
+                    file.image_format, file.image_size = image_info
+                    header = b""
+            content_hash.update(chunk)
+            file.write(chunk)
+            file.size += len(chunk)
+        if file.image_format is None:
+            raise ImageRejected("Problem with loading image!")
+    except ImageRejected:
+        file.close()
+        raise
+
+    file.content_hash = content_hash.hexdigest()
+    file.seek(0)
+    return file
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded images to disk, to the same filesystem as MEDIA_ROOT,
+    so memory used doesn't depend on file size and file is written only once
+
+    Format and dimensions are checked as soon as the header arrives,
+    wrong files are rejected before the rest of the body is read,
+    reasons are stored in request.upload_errors ({field: [(file name, error), ...]}).
+    Content is hashed on the way (for content-addressed storage).
+    Files in unchecked_fields (e.g. archives) are only streamed to disk
+    """
+    def __init__(self, request=None, unchecked_fields=()):
+        super().__init__(request)
+        self.unchecked_fields = unchecked_fields
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = StreamedImageFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.checked = self.field_name not in self.unchecked_fields
+        self.header = b""
+        self.hasher = hashlib.sha256()
+
+    def reject(self, error: str) -> None:
+        if not hasattr(self.request, "upload_errors"):
+            self.request.upload_errors = {}
+        self.request.upload_errors.setdefault(self.field_name, []).append((self.file_name, error))
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.checked and self.file.image_format is None:
+            self.header += raw_data
+            try:
+                image_info = read_image_header(self.header)
+            except ImageRejected as e:
+                self.reject(str(e))
+                raise SkipFile()
+            if image_info:
+                self.file.image_format, self.file.image_size = image_info
+                self.header = b""
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.checked and self.file.image_format is None:
+            # file ended before its header was complete
+            self.reject("Problem with loading image!")
+            self.file.close()
+            return None
+        self.file.content_hash = self.hasher.hexdigest()
+        return super().file_complete(file_size)
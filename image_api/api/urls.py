@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework import routers
-from .views import ImageViewset, get_binary_image, get_image, generate_binary_link
+from .views import ImageViewset, get_binary_image, get_image, get_signed_image, generate_binary_link
 
 
 
@@ -9,6 +9,7 @@ router.register(r'', ImageViewset, basename="images")
 
 urlpatterns = [
     path("images/<path:image_path>", get_image, name="get_image"),
+    path("signed/<path:image_path>", get_signed_image, name="get_signed_image"),
     path("generate/<path:image_path>", generate_binary_link, name="generate_binary_link"),
     path("binary/<str:token>", get_binary_image, name="get_binary_image"),
 ]
@@ -2,31 +2,209 @@ from PIL import Image
 from django.db.models import ImageField
 from io import BytesIO
 from django.core.files.base import File
+from django.conf import settings
+from django.urls import get_script_prefix, reverse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+from functools import lru_cache
+import hashlib
+import mimetypes
+import os
+import tempfile
+from urllib.parse import quote
 
 
+_executors = {}     # pools are created once per process, at first use
+URL_SAFE_CHARS = "!$&'()*+,;=/~:@"     # not quoted in URLs by django.urls.reverse
 
-def resize_image(img: Image, height: int) -> Image:
-    '''Returns resized image with given height, saves original aspect ratio'''
-    aspect_ratio = img.width/img.height
+
+
+def resize_image(img: Image, height: int, aspect_ratio: float = None) -> Image:
+    '''
+    Returns resized image with given height, saves original aspect ratio
+
+    Filter is set by RENDITION_RESAMPLE setting, big downscales are first reduced
+    by integer factor (much faster) as long as image stays RENDITION_REDUCING_GAP times bigger than requested
+    '''
+    aspect_ratio = aspect_ratio or img.width/img.height
     width = int(height * aspect_ratio)
-    return img.resize((width, height))
+    resample = Image.Resampling[settings.RENDITION_RESAMPLE.upper()]
+    return img.resize((width, height), resample=resample, reducing_gap=settings.RENDITION_REDUCING_GAP)
+
+
+def draft_image(img: Image, height: int, aspect_ratio: float) -> None:
+    '''
+    Make JPEG decoder scale image down to 1/2, 1/4 or 1/8 while decoding (DCT scaling),
+    image stays at least as big as given height. Has to be called before image is loaded
+    '''
+    if settings.RENDITION_DRAFT and img.format == "JPEG":
+        img.draft(img.mode, (int(height * aspect_ratio), height))
 
 
-def get_resized_image(image: ImageField, height: int) -> File:
-    '''Returns file containing resized image'''
-    img = Image.open(image.path)
+def encode_image(img: Image, img_format: str, profile: str = None) -> bytes:
+    '''
+    Returns image encoded in given format, with options of the encoder profile (see ENCODER_PROFILES setting),
+    profile can also strip metadata (EXIF, ICC profile)
+    '''
+    options = {}
+    if profile:
+        options = dict(settings.ENCODER_PROFILES[profile].get(img_format, {}))
+        if settings.ENCODER_PROFILES[profile].get("strip_metadata"):
+            options.update(exif=b"", icc_profile=None)      # otherwise some encoders copy them from the source
     buffer = BytesIO()
+    img.save(buffer, format=img_format, **options)
+    return buffer.getvalue()
 
-    new_image = resize_image(img, height)
-    new_image.save(buffer, format=img.format)
 
-    return File(buffer, name=image.name)
+def transcode_image(path: str, img_format: str, profile: str = None) -> bytes:
+    '''Returns image from given path encoded in another format (with options of the encoder profile)'''
+    with Image.open(path) as img:
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        return encode_image(img.convert("RGBA" if has_alpha else "RGB"), img_format, profile)
 
 
-def delete_file(path: str) -> None:
+@lru_cache
+def get_encoders() -> set[str]:
+    '''Formats Pillow can save images in (AVIF is available with pillow-avif-plugin installed)'''
+    try:
+        import pillow_avif     # registers AVIF in Pillow
+    except ImportError:
+        pass
+    Image.init()
+    return set(Image.SAVE)
+
+
+def choose_format(accept: str, formats: list[str]) -> str | None:
+    '''
+    Returns the first of formats (PIL names, in order of preference) accepted by the client,
+    according to Accept header. Only explicitly accepted types count, not image/* or */*
+    '''
+    accepted = set()
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = next((p.split("=", 1)[1] for p in params if p.replace(" ", "").startswith("q=")), "1")
+        try:
+            if float(quality) > 0:
+                accepted.add(media_type.lower())
+        except ValueError:
+            pass
+    return next((f for f in formats if get_content_type(f, "") in accepted), None)
+
+
+def render_resized_image(path: str, height: int, aspect_ratio: float, profile: str = None) -> bytes:
+    '''Opens image from given path and returns it resized and encoded (used by the process pool)'''
+    with Image.open(path) as img:
+        draft_image(img, height, aspect_ratio)
+        return encode_image(resize_image(img, height, aspect_ratio), img.format, profile)
+
+
+def get_executor(kind: str):
+    '''Returns pool used to render thumbnails, size is set by RENDITION_WORKERS setting'''
+    if kind not in _executors:
+        pool_class = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        _executors[kind] = pool_class(max_workers=settings.RENDITION_WORKERS)
+    return _executors[kind]
+
+
+def get_resized_images(image: ImageField, heights: list[int], profiles: dict[int, str] = None) -> dict[int, File]:
+    '''
+    Returns files containing resized images for all given heights,
+    encoded with encoder profiles given for heights (file.profile says which one was used)
+
+    Rendering depends on RENDITION_EXECUTOR setting:
+        "serial" - original is decoded only once, thumbnails are resized in a cascade,
+                   from the largest to the smallest one (every thumbnail is made from the previous, bigger one)
+        "thread" - original is decoded only once, thumbnails are resized from it in a thread pool
+                   (Pillow releases GIL while resizing and encoding)
+        "process" - every thumbnail is decoded, resized and encoded in a separate process
+    '''
+    heights = sorted(set(heights), reverse=True)
+    profiles = [(profiles or {}).get(height) for height in heights]
+    executor = settings.RENDITION_EXECUTOR if len(heights) > 1 else "serial"
+
+    with Image.open(image.path) as img:
+        img_format = img.format
+        aspect_ratio = img.width/img.height      # kept from the original, so rounding doesn't accumulate in the cascade
+
+        if executor == "process":
+            rendered = get_executor("process").map(render_resized_image, repeat(image.path), heights, repeat(aspect_ratio), profiles)
+        elif executor == "thread":
+            draft_image(img, heights[0], aspect_ratio)
+            img.load()
+            rendered = get_executor("thread").map(lambda height, profile: encode_image(resize_image(img, height, aspect_ratio), img_format, profile), heights, profiles)
+        else:
+            draft_image(img, heights[0], aspect_ratio)
+            rendered = []
+            source = img
+            for height, profile in zip(heights, profiles):
+                source = resize_image(source, height, aspect_ratio)
+                rendered.append(encode_image(source, img_format, profile))
+
+        files = {}
+        for height, profile, data in zip(heights, profiles, rendered):
+            files[height] = File(BytesIO(data), name=image.name)
+            files[height].profile = profile
+        return files
+
+
+def replace_file(path: str, content: File) -> None:
+    '''Writes file under exactly given path, existing file is replaced atomically'''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as temp_file:
+        for chunk in content.chunks():
+            temp_file.write(chunk)
+    os.chmod(temp_file.name, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    os.replace(temp_file.name, path)
+
+
+def get_content_hash(file: File) -> str:
+    '''Returns SHA-256 of the file content'''
+    content_hash = hashlib.sha256()
+    for chunk in file.chunks():
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def get_image_format(image: ImageField) -> str:
+    '''Returns format of the image file (PIL name, e.g. JPEG)'''
+    image.open()
+    with Image.open(image) as img:
+        return img.format
+
+
+def get_content_type(img_format: str, name: str) -> str:
+    '''Returns MIME type of the image format, guessed from the file name if format is unknown'''
+    Image.init()
+    content_type = Image.MIME.get(img_format) or mimetypes.guess_type(name)[0]
+    return content_type or "application/octet-stream"
+
+
+def delete_file(path: str) -> int:
+    '''Deletes file, returns number of freed bytes'''
     try:
         path = Path(path)
+        size = path.stat().st_size
         path.unlink(missing_ok=True)
+        return size
     except:
-        pass    # code smell, but nothing to do here - file didn't exist
\ No newline at end of file
+        return 0    # code smell, but nothing to do here - file didn't exist
+
+
+def delete_files(paths: list[str]) -> int:
+    '''Deletes files in parallel (in a thread pool), returns number of freed bytes'''
+    return sum(get_executor("files").map(delete_file, paths))
+
+@lru_cache
+def get_url_prefix(viewname: str, script_prefix: str) -> str:
+    '''Returns URL of the view up to its last argument (which has to be a path), built once for every script prefix'''
+    return reverse(viewname, args=("-",))[:-1]
+
+
+def reverse_path(viewname: str, path: str) -> str:
+    '''
+    Returns the same URL as reverse(viewname, args=(path,)) for views with path as their last argument, 
+    without resolving URL patterns for every call (it's done for lists of many images)
+    '''
+    return get_url_prefix(viewname, get_script_prefix()) + quote(path, safe=URL_SAFE_CHARS)
@@ -1,2 +1,2 @@
 from .viewsets import ImageViewset
-from .views import get_image, generate_binary_link, get_binary_image, generate_binary_image
\ No newline at end of file
+from .views import get_image, get_signed_image, generate_binary_link, get_binary_image, generate_binary_image
\ No newline at end of file
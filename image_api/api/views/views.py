@@ -1,26 +1,99 @@
-from io import BytesIO
 from uuid import uuid4
 
+from api.models import ImageVariant, UploadedImage
 from api.permissions import CheckBinaryPermission, CheckImagePermission
+from api.signing import verify_url
+from api import binary
+from api.binarization import BINARIZATION_MODES
+from api.utils import choose_format, get_content_type
 from django.conf import settings
 from django.core.cache import cache
-from django.http import HttpResponse
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django_sendfile import sendfile
 from PIL import Image
 from rest_framework import decorators, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
 
 
+class ImageContentNegotiation(DefaultContentNegotiation):
+    """
+    Accept header (and "format" parameter) of image requests chooses format of the image (see get_image, generate_binary_image), 
+    errors are still rendered with the default renderer
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except (NotAcceptable, Http404):
+            return renderers[0], renderers[0].media_type
+
+
 @decorators.api_view(["GET"])
 @decorators.permission_classes([IsAuthenticated, CheckImagePermission])
 def get_image(request, image_path: str):
     """
     Use X-SendFile to server media depending on the permissions
+
+    Thumbnails which are not rendered yet (lazy or still in the queue) are rendered first.
+    Thumbnails are served in the best format accepted by the client (Accept header) of these allowed by owner's tier,
+    variants in other formats are rendered on the first download if they weren't rendered with the thumbnail.
+    Files never change under the same name, so browsers can cache them for good 
+    and repeated requests are answered with 304 Not Modified (before sending the file)
+    """
+    access = getattr(request, "image_access", None) or {}     # cached by the permission check (not set for admins)
+    metadata = access
+    if access.get("status") != UploadedImage.Status.READY:
+        image = UploadedImage.objects.filter(pk=access["pk"]).first() if access else UploadedImage.objects.filter(image=image_path).first()
+        if image is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if image.status != UploadedImage.Status.READY:
+            image.parent.render_thumbnails([image])
+            image.refresh_from_db()
+        metadata = image.file_metadata
+
+    formats = access.get("formats", [])
+    img_format = choose_format(request.headers.get("Accept", ""), formats)
+    if img_format:
+        metadata = access["variants"].get(img_format)
+        if metadata is None:
+            metadata = ImageVariant.render(UploadedImage.objects.get(pk=access["pk"]), img_format).file_metadata
+        image_path = metadata["name"]
+
+    response = get_conditional_response(request, etag=metadata["etag"], last_modified=metadata["modified"])
+    if response is None:
+        response = sendfile(request, image_path, attachment=False, mimetype=metadata["content_type"])
+    response["ETag"] = metadata["etag"]
+    if metadata["modified"]:
+        response["Last-Modified"] = http_date(metadata["modified"])
+    response["Cache-Control"] = f"private, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable"
+    if formats:
+        patch_vary_headers(response, ["Accept"])
+    return response
+
+get_image.cls.content_negotiation_class = ImageContentNegotiation       # api_view has no decorator for that
+
+
+@decorators.api_view(["GET"])
+@decorators.authentication_classes([])
+@decorators.permission_classes([AllowAny])
+def get_signed_image(request, image_path: str):
     """
-    return sendfile(request, image_path, attachment=False, mimetype="image/jpeg")
+    Serve image by a signed link (see api.signing), without checking the user
+
+    In production nginx verifies signed links itself and doesn't call the API (see nginx.conf)
+    """
+    valid = verify_url(request.path, request.GET.get("md5", ""), request.GET.get("expires", ""), request.GET.get("k", ""))
+    if valid is None:
+        return Response(status=status.HTTP_410_GONE)      # link expired
+    if not valid:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    return sendfile(request, image_path, attachment=False)     # content type guessed from the name (like nginx does)
 
 
 @decorators.api_view(["GET"])
@@ -59,19 +132,26 @@ def get_binary_image(request, token: str):
     else:
         return Response(status=status.HTTP_404_NOT_FOUND)  # nothing to see here
 
+get_binary_image.cls.content_negotiation_class = ImageContentNegotiation
+
 
 @decorators.permission_classes([IsAuthenticated, CheckImagePermission, CheckBinaryPermission])
 def generate_binary_image(request, image_path: str):
     """
-    Load image from given path, convert to binary image 
-    and send in HTTP response as binary data
+    Send binary version of the image, it's converted only once 
+    and cached on disk - served with X-SendFile like other images (see api.binary)
+
+    Format can be chosen with GET parameter "format": png (1-bit) or tiff (CCITT Group 4), e.g. ...?format=tiff
+    and binarization with "mode": threshold, otsu, ordered or dither (see api.binarization), e.g. ...?mode=otsu
     """
-    img = Image.open(settings.MEDIA_ROOT / image_path)  # open image
-    img_format = img.format
-    
-    img = img.convert('1')  # convert photo to binary: https://en.wikipedia.org/wiki/Binary_image
-    buffer = BytesIO()
-    img.save(buffer, format=img_format)     # save image to buffer
-    mime_type = "image/png" if img_format == "PNG" else "image/jpeg"    # choose correct mimetype (only two available due to limited image formats)
-
-    return HttpResponse(buffer.getvalue(), content_type=mime_type)      # send photo as binary data in http response, using Response() caused errors with encoding(?)
+    img_format = request.GET.get("format", settings.BINARY_FORMAT).upper()
+    if img_format not in binary.BINARY_FORMATS:
+        return Response({"format": [f"Unsupported format! Must be one of: {', '.join(binary.BINARY_FORMATS).lower()}."]}, status=status.HTTP_400_BAD_REQUEST)
+    mode = request.GET.get("mode", settings.BINARIZATION_MODE)
+    if mode not in BINARIZATION_MODES:
+        return Response({"mode": [f"Unsupported mode! Must be one of: {', '.join(BINARIZATION_MODES)}."]}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        name, img_format = binary.get_binary_image(image_path, img_format, mode)
+    except FileNotFoundError:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    return sendfile(request, name, attachment=False, mimetype=get_content_type(img_format, name))
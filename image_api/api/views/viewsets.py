@@ -1,52 +1,80 @@
-from api.models import UploadedImage
+from api.models import UploadedImage, StoredFile
+from api.pagination import ImageCursorPagination
 from api.serializers import ImageSerializer, ImageSerializerCreate
-from api.utils import get_resized_image
-from rest_framework import mixins, permissions, viewsets
+from api.uploads import ImageUploadHandler
+from api.utils import get_content_hash
+from api.batch import create_images, read_archive, read_uploaded_files
+from api.cache import get_or_compute
+from rest_framework import mixins, permissions, serializers, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 
-class ImageViewset(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+class ImageViewset(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     permission_classes = [permissions.IsAuthenticated]      # allow only logged users to use the API
     queryset = UploadedImage.objects.all()                  # base queryset 
     serializer_class = ImageSerializerCreate
+    pagination_class = ImageCursorPagination
+
+    def initialize_request(self, request, *args, **kwargs):
+        """
+        Stream uploaded images straight to disk, checking their headers on the way
+        """
+        if request.method == "POST":
+            request.upload_handlers = [ImageUploadHandler(request, unchecked_fields=["archive"])]
+        return super().initialize_request(request, *args, **kwargs)
 
     def get_queryset(self):
         """
         Filter images to show only owned by the current user
         """
         queryset = super().get_queryset()
-        return queryset.filter(owner = self.request.user, parent=None)
+        queryset = queryset.filter(owner = self.request.user, parent=None)
+        if self.action in ("list", "retrieve"):
+            queryset = ImageSerializer.prefetch(queryset)      # constant number of queries for any number of images
+        return queryset
     
     def perform_create(self, serializer):
         """
         Override default function to add owner and title info. Recommended by DRF tutorial: 
         https://www.django-rest-framework.org/tutorial/4-authentication-and-permissions/#associating-snippets-with-users
         """
-        original_image = serializer.save(
-                            owner=self.request.user, 
-                            title=self.request.FILES.get("image").name
-                            ) # adding owner and title info to images
-        
-        # Basic tier - always create 200px thumbnail
-        UploadedImage.objects.create(
-            image=get_resized_image(original_image.image, 200),
-            owner = original_image.owner,
-            title = original_image.title,
-            parent=original_image
-        )
-
-        if original_image.owner.tier is not None:
-            # custom tier - create all thumbnails
-            thumbnail_sizes = original_image.owner.tier.extra_image_sizes
-            for size in thumbnail_sizes:
-                UploadedImage.objects.create(
-                image=get_resized_image(original_image.image, size),
-                owner = original_image.owner,
-                title = original_image.title,
-                parent=original_image
-                )
+        original_image = UploadedImage.from_upload(self.request.user, serializer.validated_data["image"])   # adding owner and title info to images
+        original_image.save()
+        original_image.create_thumbnails(original_image.tier_thumbnail_sizes)
 
         return original_image
 
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(lambda: super(ImageViewset, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(lambda: super(ImageViewset, self).retrieve(request, *args, **kwargs))
+
+    def get_cached_response(self, get_response) -> Response:
+        """
+        Data of list and retrieve responses is cached until the user (tier), any of their images 
+        or any tier changes - key contains generations of these scopes (see api.cache), 
+        so nothing has to be deleted, repeated requests are served by one cache lookup
+
+        Responses with signed links are cached for at most half of their timeout, so served links are never expired
+        """
+        user = self.request.user
+        timeout = settings.IMAGE_RESPONSE_CACHE_TIMEOUT
+        if settings.SIGNED_URLS:
+            signed_url_timeout = user.tier_capabilities.signed_url_timeout or settings.SIGNED_URL_TIMEOUT
+            timeout = min(timeout, signed_url_timeout // 2)
+        data = get_or_compute(
+            # Host header is set by the client, it's not a part of the key (only one entry per user and URL, links are relative)
+            f"images_response:{user.pk}:{self.request.scheme}:{self.request.get_full_path()}",
+            [f"user:{user.pk}", "tiers"],
+            lambda: get_response().data,
+            timeout,
+        )
+        return Response(data)
+
     def get_serializer_class(self, *args, **kwargs):
         """
         Return different serializer (thus different data) depending on action
@@ -67,4 +95,53 @@ class ImageViewset(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.Li
         serializer.is_valid(raise_exception=True)
         instance = self.perform_create(serializer)
         instance_serializer = ImageSerializer(instance)
-        return Response(instance_serializer.data)
\ No newline at end of file
+        return Response(instance_serializer.data)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request, *args, **kwargs):
+        """
+        Upload many images at once - as many "images" files or as one zip "archive"
+
+        Returns result for every file, wrong files don't stop the others: {"results": [
+            {"name": <file_name>, "status": "created", "image": <image data>} or
+            {"name": <file_name>, "status": "rejected", "error": <reason>},
+            ...
+        ]}
+        """
+        if "archive" in request.FILES:
+            items = read_archive(request.FILES["archive"])
+        else:
+            items = read_uploaded_files(request, "images")
+            if not items:
+                raise serializers.ValidationError({"images": ["No file was submitted."]})
+
+        created = create_images(request.user, items)
+        prefetch_related_objects([image for _, image in created if image is not None], *ImageSerializer.prefetch_lookups)
+
+        results = []
+        for item, image in created:
+            if image is None:
+                results.append({"name": item.name, "status": "rejected", "error": item.error})
+            else:
+                results.append({"name": item.name, "status": "created", "image": ImageSerializer(image).data})
+        return Response({"results": results})
+
+    @action(detail=False, methods=["post"], url_path="delete")
+    def bulk_delete(self, request, *args, **kwargs):
+        """
+        Delete many images (with their thumbnails) at once: {"ids": [<id>, ...]}
+        Files are deleted from storage after the request is committed (see api.reaper)
+
+        Returns {"deleted": [<id>, ...], "not_found": [<id>, ...]}
+        """
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or not ids or not all(isinstance(k, int) and not isinstance(k, bool) for k in ids):
+            raise serializers.ValidationError({"ids": ["Expected a non-empty list of image ids."]})
+        if len(ids) > settings.BULK_DELETE_MAX_IDS:
+            raise serializers.ValidationError({"ids": [f"Too many ids, at most {settings.BULK_DELETE_MAX_IDS} are allowed."]})
+
+        images = self.get_queryset().filter(pk__in=ids)
+        with transaction.atomic():
+            deleted = set(images.select_for_update().values_list("pk", flat=True))
+            UploadedImage.objects.filter(pk__in=deleted).delete()
+        return Response({"deleted": sorted(deleted), "not_found": sorted(set(ids) - deleted)})
@@ -146,9 +146,91 @@ SENDFILE_ROOT = Path("/images")
 SENDFILE_URL = "/protected"     # nginx decides about resources to send based on this url
 
 
+# uploaded images are checked by their first bytes, before the rest of the file is received:
+UPLOAD_HEADER_MAX_SIZE = 256 * 1024     # files without complete image header in that many bytes are rejected
+BATCH_MAX_FILES = 1000                  # maximum number of images in one batch upload (files or archive entries)
+BATCH_MAX_FILE_SIZE = 64 * 2**20        # maximum uncompressed size of one archive entry
+BATCH_MAX_ARCHIVE_SIZE = 1024 * 2**20   # maximum uncompressed size of all entries of an archive, entries over it are rejected
+BATCH_INSERT_SIZE = 50                  # images of a batch inserted at once (their thumbnails rendered in advance are kept in memory until then)
+BULK_DELETE_MAX_IDS = 10000             # maximum number of images deleted in one request
+IMAGE_LIST_PAGE_SIZE = 50               # images on one page of the list (can be changed with ?page_size=)
+IMAGE_LIST_MAX_PAGE_SIZE = 500          # maximum ?page_size= of the list
+
+# API responses (JSON is rendered with orjson if it's installed, see api.renderers):
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600   # how long browsers can keep downloaded images (files never change under the same name)
+
+# signed links to images (nginx secure_link compatible):
+SIGNED_URLS = bool(os.getenv("SIGNED_URL_KEY"))     # image links in responses are signed, served by nginx without asking the API (see nginx.conf)
+SIGNED_URL_KEYS = {                     # key id -> secret, previous key is kept while rotating (the same keys are given to nginx)
+    os.getenv(f"{name}_ID"): os.getenv(name)
+    for name in ["SIGNED_URL_OLD_KEY", "SIGNED_URL_KEY"] if os.getenv(name)
+}
+SIGNED_URL_KEY_ID = os.getenv("SIGNED_URL_KEY_ID")   # key used to sign new links
+SIGNED_URL_TIMEOUT = 3600               # how long links are valid (seconds) if user's tier doesn't say otherwise
+SIGNED_URL_ALIGNMENT = 300              # expiry time is rounded up to that many seconds, so links don't change with every request
+
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': f'redis://{os.getenv("REDIS_HOST")}:{os.getenv("REDIS_PORT")}',
     }
 }
+
+# data cached in process memory (in front of the cache above):
+LOCAL_CACHE_TIMEOUT = 5                 # seconds other processes can use data that was already invalidated
+LOCAL_CACHE_MAX_SIZE = 10000            # maximum number of entries in every process
+IMAGE_ACCESS_CACHE_TIMEOUT = 3600       # decisions if user can see an image file (invalidated on every change anyway)
+IMAGE_RESPONSE_CACHE_TIMEOUT = 300      # list and retrieve responses of users (invalidated on every change too), at most half of signed links timeout
+TIER_CACHE_TIMEOUT = 3600               # capabilities of tiers (heights, binary and original images), invalidated on every change too
+
+
+# Thumbnails rendering:
+RENDITION_QUEUE = True                  # render thumbnails in background workers (manage.py rendition_worker) instead of the request
+RENDITION_JOB_MAX_ATTEMPTS = 3          # failed rendering jobs are retried this many times
+RENDITION_EXECUTOR = "thread"           # how sizes of one image are rendered: "serial", "thread" (pool) or "process" (pool)
+RENDITION_WORKERS = None                # size of the rendering pool, None = number of CPUs
+RENDITION_RESAMPLE = "lanczos"          # resampling filter (speed/quality): "nearest", "box", "bilinear", "hamming", "bicubic" or "lanczos"
+RENDITION_REDUCING_GAP = 3.0            # reduce image by integer factor first, while it's this many times bigger than thumbnail (None = off)
+RENDITION_DRAFT = True                  # decode JPEGs already scaled down (1/2, 1/4 or 1/8) if thumbnail is small enough
+ENCODER_PROFILES = {                    # options of PIL encoders for every format of thumbnails (and their variants)
+    "default": {                        # PIL defaults
+        "WEBP": {"quality": 80, "method": 4},
+        "AVIF": {"quality": 60},        # requires pillow-avif-plugin
+    },
+    "fast": {                           # low effort, quick encoding
+        "JPEG": {"quality": 80},
+        "PNG": {"compress_level": 1},
+        "WEBP": {"quality": 80, "method": 0},
+        "AVIF": {"quality": 60, "speed": 10},
+    },
+    "small": {                          # optimized, progressive, metadata stripped
+        "strip_metadata": True,
+        "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+        "PNG": {"optimize": True},
+        "WEBP": {"quality": 75, "method": 6},
+        "AVIF": {"quality": 55, "speed": 4},
+    },
+}
+ENCODER_PROFILE = "default"             # profile of thumbnails, unless their tier or height (AvailableHeight) says otherwise
+UPLOAD_ENCODER_PROFILE = None           # profile used when thumbnails are rendered first (e.g. "fast"), then re-encoded in the background
+                                        # with the target profile (manage.py reencode_thumbnails), None = target profile right away
+REENCODE_BATCH_SIZE = 100               # thumbnails re-encoded in one transaction
+BACKFILL_CHUNK_SIZE = 500               # originals processed at once when thumbnails are added to existing images (e.g. tier change)
+BACKFILL_JOB_MAX_ATTEMPTS = 3           # failed chunks of backfill jobs are retried this many times, then the job is abandoned
+BINARY_CACHE_MAX_SIZE = 1024 * 2**20   # binary images are converted once and cached on disk, least recently used are evicted above that many bytes
+BINARY_CACHE_EVICTION_INTERVAL = 60     # eviction runs at most once per that many seconds
+BINARY_CACHE_EAGER = False              # convert thumbnails (and originals) to binary in advance, in tiers with binary images
+BINARY_FORMAT = "PNG"                   # default format of binary images: "PNG" (1-bit) or "TIFF" (CCITT Group 4)
+BINARIZATION_MODE = "dither"            # default binarization of binary images: "threshold", "otsu", "ordered" or "dither" (api.binarization)
+BINARIZATION_THRESHOLD = 128            # threshold of "threshold" binarization mode (0-255)
+THUMBNAIL_GC_GRACE_PERIOD = 7 * 24 * 3600   # thumbnails unavailable in owner's tier for that many seconds are deleted (manage.py collect_thumbnails)
+THUMBNAIL_GC_BATCH_SIZE = 500           # thumbnails deleted in one transaction
+FILE_REAPER_BATCH_SIZE = 500            # files of deleted images released and unlinked at once, after commit